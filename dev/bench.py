@@ -0,0 +1,386 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+import uuid
+from urllib.parse import parse_qs, urlsplit
+
+from rich import print
+from rich.table import Table
+from websockets.asyncio.server import serve
+from websockets.exceptions import ConnectionClosed
+
+SCENARIOS = ("frames", "ls", "download", "zip", "terminal")
+MB = 1024 * 1024
+
+
+class Relay:
+    """Local stand-in for the accept/live relay, with the benchmark as the viewer.
+
+    The agent's control socket connects to ``/accept`` and gets a session id,
+    like from guby.gay. Feature channels connect to ``/live/<session>`` and
+    are queued by channel name (``?channel=``, ``X-Stream-Channel`` or
+    ``stream`` for the first monitor) until a scenario takes them.
+    """
+
+    def __init__(self):
+        self.session_id = uuid.uuid4().hex[:12]
+        self.control = None
+        self.connected = asyncio.Event()
+        self.replies: dict[str, asyncio.Queue] = {}
+        self.channels: dict[str, asyncio.Queue] = {}
+
+    def queue(self, name: str) -> asyncio.Queue:
+        return self.channels.setdefault(name, asyncio.Queue())
+
+    async def handler(self, websocket):
+        url = urlsplit(websocket.request.path)
+        if url.path.rstrip("/").endswith("accept"):
+            await self.accept(websocket)
+            return
+        name = (
+            parse_qs(url.query).get("channel", [None])[0]
+            or websocket.request.headers.get("X-Stream-Channel")
+            or "stream"
+        )
+        self.queue(name).put_nowait(websocket)
+        # The connection lives until the scenario or the agent closes it
+        await websocket.wait_closed()
+
+    async def accept(self, websocket):
+        await websocket.send(json.dumps({"id": self.session_id}))
+        self.control = websocket
+        self.connected.set()
+        try:
+            async for message in websocket:
+                reply = json.loads(message)
+                queue = self.replies.get(reply.get("requestId"))
+                if queue:
+                    queue.put_nowait(reply)
+        except ConnectionClosed:
+            pass
+
+    async def request(self, request: str, **fields) -> tuple[str, asyncio.Queue]:
+        request_id = uuid.uuid4().hex[:12]
+        queue = self.replies[request_id] = asyncio.Queue()
+        await self.control.send(
+            json.dumps({"request": request, "requestId": request_id, **fields})
+        )
+        return request_id, queue
+
+    async def reply(self, queue: asyncio.Queue, event: str, timeout: float = 60) -> dict:
+        """Wait for the reply ``event``, skipping progress events."""
+        while True:
+            reply = await asyncio.wait_for(queue.get(), timeout)
+            if reply.get("event") == event:
+                return reply
+
+    async def channel(self, name: str, timeout: float = 30):
+        return await asyncio.wait_for(self.queue(name).get(), timeout)
+
+
+def percentiles(values: list[float]) -> dict[str, float]:
+    """p50/p95/p99 and max of ``values`` (seconds), in milliseconds."""
+    ordered = sorted(values)
+    if not ordered:
+        return {}
+
+    def at(q: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 2)
+
+    return {"p50Ms": at(0.5), "p95Ms": at(0.95), "p99Ms": at(0.99), "maxMs": at(1)}
+
+
+def make_tree(folder: str, files: int, file_mb: int):
+    """Generate the benchmark data: a flat directory for ``ls``, a nested tree
+    of small files for ``zip`` and one large file for ``download``."""
+    flat = os.path.join(folder, "flat")
+    os.makedirs(flat)
+    for index in range(files):
+        with open(os.path.join(flat, f"file-{index:06}.txt"), "w") as file:
+            file.write("x" * (index % 4096))
+
+    tree = os.path.join(folder, "tree")
+    for index in range(min(files, 2000)):
+        directory = os.path.join(tree, f"dir-{index // 100:02}")
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, f"part-{index:04}.log"), "wb") as file:
+            # Half text (compressible), half random, like a typical project
+            file.write(b"log line %d\n" % index * 256 + os.urandom(32 * 1024))
+
+    with open(os.path.join(folder, "large.bin"), "wb") as file:
+        for _ in range(file_mb):
+            file.write(os.urandom(MB))
+
+
+async def frames(relay: Relay, options) -> dict:
+    websocket = await relay.channel("stream")
+    arrivals = []
+    total = 0
+    started = time.perf_counter()
+    while (elapsed := time.perf_counter() - started) < options.duration:
+        try:
+            message = await asyncio.wait_for(
+                websocket.recv(), options.duration - elapsed
+            )
+        except TimeoutError:
+            break
+        arrivals.append(time.perf_counter())
+        total += len(message)
+    elapsed = time.perf_counter() - started
+
+    _, queue = await relay.request("streamStats")
+    stats = (await relay.reply(queue, "streamStats"))["stats"]
+    gaps = [later - earlier for earlier, later in zip(arrivals, arrivals[1:])]
+    return {
+        "fps": round(len(arrivals) / elapsed, 1),
+        "frameIntervalMs": percentiles(gaps),
+        "mbPerSecond": round(total / elapsed / MB, 2),
+        "agentStats": stats,
+    }
+
+
+async def ls(relay: Relay, options) -> dict:
+    latencies = []
+    cold = None
+    for attempt in range(options.repeat):
+        started = time.perf_counter()
+        _, queue = await relay.request("ls", path="root/flat")
+        reply = await relay.reply(queue, "ls")
+        latency = time.perf_counter() - started
+        if attempt == 0:
+            cold = latency
+        else:
+            latencies.append(latency)
+
+    started = time.perf_counter()
+    _, queue = await relay.request("ls", path="root/flat", stream=True, limit=500)
+    first = None
+    while not (reply := await relay.reply(queue, "ls")).get("done"):
+        first = first or time.perf_counter() - started
+    return {
+        "entries": len(reply.get("contents", [])) or reply.get("total"),
+        "coldMs": round(cold * 1000, 2),
+        "warm": percentiles(latencies),
+        "streamFirstBatchMs": round((first or 0) * 1000, 2),
+    }
+
+
+async def receive_all(websocket) -> int:
+    """Read binary messages until the agent closes the channel, returns their size."""
+    total = 0
+    try:
+        async for message in websocket:
+            if isinstance(message, bytes):
+                total += len(message)
+    except ConnectionClosed:
+        pass
+    return total
+
+
+async def download(relay: Relay, options) -> dict:
+    results = {}
+    for channels in (1, 4):
+        started = time.perf_counter()
+        fields = {"channels": channels} if channels > 1 else {}
+        request_id, _ = await relay.request("download", url="root/large.bin", **fields)
+        names = [request_id] if channels == 1 else [
+            f"{request_id}:{index}" for index in range(channels)
+        ]
+        sockets = await asyncio.gather(*(relay.channel(name) for name in names))
+        total = sum(await asyncio.gather(*(receive_all(ws) for ws in sockets)))
+        elapsed = time.perf_counter() - started
+        results[f"channels{channels}"] = {
+            "mb": round(total / MB, 1),
+            "mbPerSecond": round(total / elapsed / MB, 1),
+        }
+    return results
+
+
+async def zip_folder(relay: Relay, options) -> dict:
+    results = {}
+    for compression in ("stored", "deflate"):
+        started = time.perf_counter()
+        request_id, _ = await relay.request(
+            "download", url="root/tree", compression=compression
+        )
+        total = await receive_all(await relay.channel(request_id))
+        elapsed = time.perf_counter() - started
+        results[compression] = {
+            "mb": round(total / MB, 1),
+            "mbPerSecond": round(total / elapsed / MB, 1),
+            "seconds": round(elapsed, 2),
+        }
+    return results
+
+
+async def terminal(relay: Relay, options) -> dict:
+    if sys.platform == "win32":
+        return {"skipped": "лише Unix"}
+    session = "bench"
+    await relay.control.send(
+        json.dumps(
+            {
+                "request": "terminal",
+                "event": {"action": "open", "session": session, "columns": 200, "lines": 50},
+            }
+        )
+    )
+    websocket = await relay.channel(f"terminal-{session}")
+    # The marker is computed by the shell, so the echoed command never matches it
+    marker = b"__BENCH_42__"
+    await websocket.send(
+        f"head -c {options.terminal_mb * MB * 3 // 4} /dev/urandom | base64; "
+        "echo __BENCH_$((6*7))__\n"
+    )
+    started = time.perf_counter()
+    total = 0
+    messages = 0
+    tail = b""
+    while True:
+        message = await asyncio.wait_for(websocket.recv(), 120)
+        data = message.encode() if isinstance(message, str) else message
+        total += len(data)
+        messages += 1
+        if marker in tail + data:
+            break
+        tail = data[-len(marker) :]
+    elapsed = time.perf_counter() - started
+    await websocket.close()
+    await relay.control.send(
+        json.dumps({"request": "terminal", "event": {"action": "close", "session": session}})
+    )
+    return {
+        "mb": round(total / MB, 1),
+        "mbPerSecond": round(total / elapsed / MB, 1),
+        "messages": messages,
+    }
+
+
+RUNNERS = {
+    "frames": frames,
+    "ls": ls,
+    "download": download,
+    "zip": zip_folder,
+    "terminal": terminal,
+}
+
+
+def peak_rss_mb(pid: int) -> float | None:
+    """Peak resident set of the running agent (Linux), else None."""
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+async def run(options) -> dict:
+    relay = Relay()
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="dimon-bench-") as folder:
+        print(f"Генерація даних у {folder}...")
+        await asyncio.to_thread(make_tree, folder, options.files, options.file_mb)
+
+        async with serve(relay.handler, "127.0.0.1", options.port, max_size=None) as server:
+            port = server.sockets[0].getsockname()[1]
+            agent = await asyncio.create_subprocess_exec(
+                sys.executable,
+                os.path.join(os.path.dirname(os.path.abspath(__file__)), "mjpeg.py"),
+                "--http",
+                "--accept", f"127.0.0.1:{port}/accept",
+                "--stream", f"127.0.0.1:{port}/live",
+                "--folder", folder,
+                "--source", options.source,
+                *options.agent_args,
+                stdout=None if options.verbose else asyncio.subprocess.DEVNULL,
+                stderr=None if options.verbose else asyncio.subprocess.DEVNULL,
+            )  # fmt: skip
+            try:
+                await asyncio.wait_for(relay.connected.wait(), 60)
+                for name in options.scenarios:
+                    print(f"Сценарій {name}...")
+                    try:
+                        results[name] = await RUNNERS[name](relay, options)
+                    except Exception as err:
+                        results[name] = {"error": repr(err)}
+                    if agent.returncode is not None:
+                        results["agentExited"] = agent.returncode
+                        break
+                results["peakRssMb"] = peak_rss_mb(agent.pid)
+            finally:
+                if agent.returncode is None:
+                    agent.terminate()
+                await agent.wait()
+
+    if results.get("peakRssMb") is None and sys.platform != "win32":
+        import resource  # Unix only
+
+        # ru_maxrss is in KB on Linux and in bytes on macOS
+        rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+        results["peakRssMb"] = round(rss / (MB if sys.platform == "darwin" else 1024), 1)
+    return results
+
+
+def report(results: dict):
+    table = Table("Сценарій", "Показник", "Значення")
+
+    def rows(scenario: str, prefix: str, value):
+        if isinstance(value, dict):
+            for key, item in value.items():
+                rows(scenario, f"{prefix}.{key}" if prefix else key, item)
+        else:
+            table.add_row(scenario, prefix, str(value))
+
+    for scenario, value in results.items():
+        rows(scenario, "", value)
+    print(table)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Бенчмарк агента з локальним ретранслятором замість guby.gay"
+    )
+    parser.add_argument(
+        "--scenarios",
+        type=lambda value: [name for name in value.split(",") if name],
+        default=list(SCENARIOS),
+        help=f"Сценарії через кому (дефолт: {','.join(SCENARIOS)})",
+    )
+    parser.add_argument("--port", type=int, default=0, help="Порт ретранслятора (дефолт: вільний)")
+    parser.add_argument("--duration", type=float, default=10, help="Тривалість сценарію frames, с")
+    parser.add_argument("--repeat", type=int, default=50, help="Кількість запитів ls")
+    parser.add_argument("--files", type=int, default=10000, help="Кількість файлів для ls")
+    parser.add_argument("--file-mb", type=int, default=256, help="Розмір файла для download, МБ")
+    parser.add_argument("--terminal-mb", type=int, default=64, help="Обсяг виводу терміналу, МБ")
+    parser.add_argument(
+        "--source",
+        default="synthetic:motion",
+        help="Джерело кадрів агента (дефолт: synthetic:motion, без дисплея)",
+    )
+    parser.add_argument("--output", default=None, help="Зберегти результати у JSON-файл")
+    parser.add_argument("--verbose", action="store_true", help="Показувати вивід агента")
+    parser.add_argument(
+        "agent_args",
+        nargs=argparse.REMAINDER,
+        help="Аргументи агента після --, напр. -- --codec tiles",
+    )
+
+    options = parser.parse_args()
+    unknown = set(options.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"Невідомі сценарії: {', '.join(sorted(unknown))}")
+    if options.agent_args[:1] == ["--"]:
+        options.agent_args = options.agent_args[1:]
+
+    results = asyncio.run(run(options))
+    report(results)
+    if options.output:
+        with open(options.output, "w") as file:
+            json.dump(results, file, indent=2)
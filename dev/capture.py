@@ -0,0 +1,353 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+import cv2
+import numpy as np
+from metrics import frame_stage_seconds
+from rich import print
+from rich.traceback import Traceback
+from sources import FrameSource, MssSource
+from tiles import TileUpdate, dirty_rects
+from video import CODECS, VideoEncoder, VideoUpdate, encoder_available
+
+
+# Tile and packet counts are u16 in the message header
+MAX_MERGED = 0xFFFF
+# Hard cap on a coalesced update waiting to be sent, whatever a keyframe costs
+MAX_PENDING_BYTES = 2 * 1024 * 1024
+
+
+class LatestFrame:
+    """Single-slot asyncio mailbox: a newer frame always replaces an unsent one.
+
+    With ``merge`` set, the unsent frame is combined with the newer one instead
+    (used by tile and video updates, which are only meaningful as a sequence).
+    A merged backlog that grows past the size of a keyframe, past ``max_bytes``
+    or past what one message can count, is dropped and ``on_overflow`` asks for a keyframe
+    instead; updates are then skipped until it arrives.
+    """
+
+    def __init__(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        merge=None,
+        on_overflow=None,
+        max_bytes: int = MAX_PENDING_BYTES,
+    ):
+        self.loop = loop
+        self.merge = merge
+        self.on_overflow = on_overflow
+        self.max_bytes = max_bytes
+        self.frame = None
+        self.captured_at = 0.0
+        self.seq = -1
+        self.dropped = 0  # frames replaced or coalesced before they were sent
+        self.keyframe_size = 0  # size of the last keyframe, the merge budget
+        self.awaiting_keyframe = False
+        self.event = asyncio.Event()
+
+    def put(self, seq: int, frame, captured_at: float):
+        # Called on the event loop thread only
+        if seq <= self.seq:
+            self.dropped += 1
+            return  # an encoder finished out of order, keep the newer frame
+        self.seq = seq
+        if self.on_overflow:
+            if frame.keyframe:
+                self.keyframe_size = frame.size()
+                self.awaiting_keyframe = False
+            elif self.awaiting_keyframe:
+                self.dropped += 1
+                return  # would only patch a picture the viewer never got
+        if self.frame is not None:
+            self.dropped += 1
+            if self.merge:
+                # Keep the age of the oldest content still waiting to be sent
+                merged = self.merge(self.frame, frame)
+                if self.on_overflow and self.overflows(merged):
+                    self.resync()
+                    return
+                frame = merged
+                captured_at = self.captured_at
+        self.frame = frame
+        self.captured_at = captured_at
+        self.event.set()
+
+    def overflows(self, merged) -> bool:
+        if len(merged) > MAX_MERGED:
+            return True
+        size = merged.size()
+        return size > self.max_bytes or bool(self.keyframe_size) and size > self.keyframe_size
+
+    def resync(self):
+        """Replace the backlog by a keyframe. A pending keyframe is kept, so the
+        viewer still gets a complete (if older) picture in the meantime."""
+        if not self.frame.keyframe:
+            self.frame = None
+            self.event.clear()
+        self.awaiting_keyframe = True
+        self.on_overflow()
+
+    def put_threadsafe(self, seq: int, frame, captured_at: float):
+        self.loop.call_soon_threadsafe(self.put, seq, frame, captured_at)
+
+    async def get(self):
+        while self.frame is None:
+            await self.event.wait()
+            self.event.clear()
+        frame, self.frame = self.frame, None
+        return frame, self.captured_at
+
+
+class CapturePipeline:
+    """Grab the screen on a dedicated thread and JPEG-encode frames on a worker pool.
+
+    The event loop only ever awaits finished JPEG bytes, so screen capture and
+    encoding never block command handling.
+
+    In ``tiles`` mode every frame is diffed against the previous one and only
+    the changed tiles are encoded (in parallel) and sent, see ``tiles.py``.
+    In ``h264``/``vp8`` mode frames go through an inter-frame encoder on the
+    capture thread, see ``video.py``.
+
+    Frames come from ``source``, the screens unless a synthetic or recorded
+    source is given, see ``sources.py``.
+    """
+
+    def __init__(
+        self,
+        monitor_index: int = 1,
+        quality: int = 30,
+        fps: float = 60,
+        workers: int | None = None,
+        mode: str = "mjpeg",
+        bitrate: int = 2_000_000,
+        source: Callable[[], FrameSource] = MssSource,
+        max_pending: int = MAX_PENDING_BYTES,
+    ):
+        self.monitor_index = monitor_index
+        self.max_pending = max_pending
+        self.source = source
+        self.mode = mode
+        self.quality = quality
+        self.fps = fps
+        self.bitrate = bitrate  # video modes only, see QualityController
+        self.scale = 1.0  # output size relative to the monitor, see QualityController
+        self.region = None  # (x, y, width, height) as fractions of the monitor
+        self.target_size = None  # (width, height) the viewer actually displays
+        self.workers = workers or max(1, min(4, (os.cpu_count() or 2) - 1))
+        self.executor = None
+        self.thread = None
+        self.frames = None
+        self.running = threading.Event()
+        self.in_flight = threading.Semaphore(self.workers)
+        self.keyframe_requested = threading.Event()
+        self.prev = None
+        self.video = None
+        if mode in CODECS:
+            if encoder_available(mode):
+                self.video = VideoEncoder(mode, fps, bitrate)
+            else:
+                print(f"Кодек {mode} недоступний, використовується mjpeg")
+                self.mode = "mjpeg"
+
+    def start(self):
+        merge = {"tiles": TileUpdate.merge}.get(self.mode)
+        if self.video:
+            merge = VideoUpdate.merge
+        # A backlog of tiles or inter frames is replaced by a keyframe (an IDR
+        # frame for video) once it costs more than one
+        on_overflow = self.request_keyframe if merge else None
+        self.frames = LatestFrame(
+            asyncio.get_running_loop(),
+            merge=merge,
+            on_overflow=on_overflow,
+            max_bytes=self.max_pending,
+        )
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix="encode"
+        )
+        self.running.set()
+        self.thread = threading.Thread(
+            target=self.capture_loop, name="capture", daemon=True
+        )
+        self.thread.start()
+
+    def stop(self):
+        # Signalled, not joined, so a grab or encode in progress never blocks the
+        # event loop: the thread exits after its current frame
+        self.running.clear()
+        self.thread = None
+        if self.executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    def set_view(
+        self,
+        region: tuple[float, float, float, float] | None,
+        target_size: tuple[int, int] | None,
+    ):
+        """Capture only ``region`` of the monitor and fit it into ``target_size``."""
+        if region:
+            x, y, width, height = (min(max(float(v), 0.0), 1.0) for v in region)
+            width = min(width, 1 - x)
+            height = min(height, 1 - y)
+            region = (x, y, width, height) if width > 0 and height > 0 else None
+        if target_size:
+            target_size = (max(1, int(target_size[0])), max(1, int(target_size[1])))
+        self.region = region
+        self.target_size = target_size
+        self.request_keyframe()
+
+    def to_screen(self, x: float, y: float) -> tuple[float, float]:
+        """Map a point normalized to the streamed picture to one normalized to the monitor."""
+        if self.region is None:
+            return x, y
+        left, top, width, height = self.region
+        return left + x * width, top + y * height
+
+    def request_keyframe(self):
+        """Make the next update a full frame (on connect or viewer request)."""
+        self.keyframe_requested.set()
+
+    async def get(self) -> tuple[bytes, float]:
+        """Wait for the newest encoded frame, returns it with its capture time."""
+        frame, captured_at = await self.frames.get()
+        if isinstance(frame, (TileUpdate, VideoUpdate)):
+            frame = frame.pack()
+        return frame, captured_at
+
+    def capture_loop(self):
+        seq = 0
+        with self.source() as source:
+            monitor = source.monitors[self.monitor_index]
+            while self.running.is_set():
+                started = time.perf_counter()
+
+                try:
+                    if self.video:
+                        self.capture_video(seq, source, monitor)
+                        seq += 1
+                    elif self.mode == "tiles":
+                        self.capture_tiles(seq, source, monitor)
+                        seq += 1
+                    # Only grab when an encoder is free, otherwise the frame would be
+                    # stale by the time it got encoded anyway
+                    elif self.in_flight.acquire(timeout=0.1):
+                        try:
+                            captured_at = time.perf_counter()
+                            frame = self.grab(source, monitor)
+                            self.executor.submit(self.encode, seq, frame, captured_at)
+                            seq += 1
+                        except Exception:
+                            self.in_flight.release()
+                            raise
+                except Exception:
+                    if not self.running.is_set():
+                        break
+                    print(Traceback(show_locals=False))
+
+                # Control frame rate (e.g., 60 FPS)
+                delay = 1 / self.fps - (time.perf_counter() - started)
+                if delay > 0:
+                    time.sleep(delay)
+
+    def grab(self, source: FrameSource, monitor: dict) -> np.ndarray:
+        region = self.region
+        if region:
+            # Let the source copy only the requested rectangle instead of the whole screen
+            x, y, width, height = region
+            monitor = {
+                "left": monitor["left"] + round(x * monitor["width"]),
+                "top": monitor["top"] + round(y * monitor["height"]),
+                "width": max(1, round(width * monitor["width"])),
+                "height": max(1, round(height * monitor["height"])),
+            }
+        with frame_stage_seconds.time("grab"):
+            frame = source.grab(monitor)
+
+        height, width = frame.shape[:2]
+        scale = self.scale
+        if self.target_size:
+            # Fit into the viewer's size keeping the aspect ratio, never upscale
+            scale *= min(self.target_size[0] / width, self.target_size[1] / height, 1)
+        if scale < 1:
+            with frame_stage_seconds.time("scale"):
+                frame = cv2.resize(
+                    frame,
+                    (max(1, round(width * scale)), max(1, round(height * scale))),
+                    interpolation=cv2.INTER_AREA,
+                )
+        return frame
+
+    def encode(self, seq: int, frame: np.ndarray, captured_at: float):
+        try:
+            # Convert BGRA to BGR (opencv uses BGR format)
+            with frame_stage_seconds.time("convert"):
+                frame = cv2.cvtColor(frame, cv2.COLOR_BGRA2BGR)
+
+            # Encode frame as JPEG
+            with frame_stage_seconds.time("encode"):
+                result, encoded_img = cv2.imencode(
+                    ".jpg", frame, [int(cv2.IMWRITE_JPEG_QUALITY), self.quality]
+                )
+            if result:
+                self.frames.put_threadsafe(seq, encoded_img.tobytes(), captured_at)
+        except Exception:
+            print(Traceback(show_locals=False))
+        finally:
+            self.in_flight.release()
+
+    def capture_tiles(self, seq: int, source: FrameSource, monitor: dict):
+        captured_at = time.perf_counter()
+        frame = self.grab(source, monitor)
+        keyframe = (
+            self.prev is None
+            or self.prev.shape != frame.shape
+            or self.keyframe_requested.is_set()
+        )
+        self.keyframe_requested.clear()
+
+        with frame_stage_seconds.time("diff"):
+            rects = dirty_rects(None if keyframe else self.prev, frame)
+        self.prev = frame
+        if not rects:
+            return  # nothing changed, nothing to send
+
+        # Tiles of one frame are independent, encode them across the pool
+        with frame_stage_seconds.time("encode"):
+            jpegs = self.executor.map(lambda rect: self.encode_tile(frame, rect), rects)
+            tiles = [(*rect, jpeg) for rect, jpeg in zip(rects, jpegs) if jpeg]
+        height, width = frame.shape[:2]
+        self.frames.put_threadsafe(
+            seq, TileUpdate(width, height, keyframe, tiles), captured_at
+        )
+
+    def encode_tile(self, frame: np.ndarray, rect: tuple[int, int, int, int]) -> bytes:
+        x, y, w, h = rect
+        tile = cv2.cvtColor(frame[y : y + h, x : x + w], cv2.COLOR_BGRA2BGR)
+        result, encoded_img = cv2.imencode(
+            ".jpg", tile, [int(cv2.IMWRITE_JPEG_QUALITY), self.quality]
+        )
+        return encoded_img.tobytes() if result else b""
+
+    def capture_video(self, seq: int, source: FrameSource, monitor: dict):
+        captured_at = time.perf_counter()
+        frame = self.grab(source, monitor)
+        keyframe = self.keyframe_requested.is_set()
+        self.keyframe_requested.clear()
+        # The QualityController sets the bitrate from the event loop, the encoder
+        # follows here
+        if self.video.bitrate != self.bitrate:
+            self.video.set_bitrate(self.bitrate)
+
+        # Inter-frame codecs must see every frame in order, so encode inline; the
+        # encoder runs its own threads
+        with frame_stage_seconds.time("encode"):
+            update = self.video.encode(frame, keyframe, captured_at)
+        if update:
+            self.frames.put_threadsafe(seq, update, captured_at)
@@ -0,0 +1,85 @@
+import asyncio
+import time
+from typing import Awaitable, Callable
+
+from metrics import command_seconds
+from rich import print
+from rich.traceback import Traceback
+
+Handler = Callable[[dict], Awaitable[None]]
+
+
+class Dispatcher:
+    """Run control requests concurrently instead of one after another.
+
+    Every request type is either
+
+    * concurrent: each message becomes its own task, at most ``limit`` of a type
+      running at once, so a long download can't hold up ``ls`` or ``rm``; or
+    * on an ordered lane: messages are queued and handled one by one by the
+      lane's worker task, for requests whose order matters (input events,
+      terminal open/sync/close).
+
+    The receive loop only routes messages, so input events reach their lane
+    immediately even while transfers are running.
+    """
+
+    def __init__(self):
+        self.handlers: dict[str, tuple[Handler, asyncio.Semaphore | None, str | None]] = {}
+        self.lanes: dict[str, asyncio.Queue] = {}
+        self.workers: list[asyncio.Task] = []
+        self.tasks: set[asyncio.Task] = set()
+
+    def register(
+        self,
+        request: str,
+        handler: Handler,
+        limit: int | None = None,
+        lane: str | None = None,
+    ):
+        if lane and lane not in self.lanes:
+            self.lanes[lane] = asyncio.Queue()
+            self.workers.append(asyncio.create_task(self.lane_worker(lane)))
+        semaphore = asyncio.Semaphore(limit) if limit else None
+        self.handlers[request] = (handler, semaphore, lane)
+
+    def dispatch(self, message: dict):
+        entry = self.handlers.get(message.get("request"))
+        if entry is None:
+            print(f"Невідомий запит: {message.get('request')}")
+            return
+        handler, semaphore, lane = entry
+        received = time.perf_counter()
+
+        if lane:
+            self.lanes[lane].put_nowait((handler, message, received))
+            return
+
+        task = asyncio.create_task(self.run(handler, semaphore, message, received))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def run(self, handler: Handler, semaphore, message: dict, received: float):
+        try:
+            if semaphore:
+                async with semaphore:
+                    await handler(message)
+            else:
+                await handler(message)
+        except Exception as e:
+            assert e
+            print(Traceback(show_locals=False))
+        finally:
+            # Includes the wait for a free slot or the lane, as the viewer sees it
+            command_seconds.observe(time.perf_counter() - received, message["request"])
+
+    async def lane_worker(self, lane: str):
+        queue = self.lanes[lane]
+        while True:
+            handler, message, received = await queue.get()
+            await self.run(handler, None, message, received)
+
+    async def close(self):
+        for task in [*self.workers, *self.tasks]:
+            task.cancel()
+        await asyncio.gather(*self.workers, *self.tasks, return_exceptions=True)
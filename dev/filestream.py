@@ -1,41 +1,107 @@
-import io
+import asyncio
+import json
 import os
-import zipfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import aclosing
 
 import websockets.asyncio.client as websockets
+from fsjobs import Job, in_fs_thread
+from metrics import transfer_bytes
+from mux import BULK, Connector
+from reconnect import connect_with_backoff
+from zipstream import CHUNK_SIZE, stored_size, stream_zip, walk_files
 
+MAX_CHANNELS = 8
+CONNECT_ATTEMPTS = 5
 
-async def stream_zip_directory(ws: websockets.ClientConnection, folder_path: str):
-    """Stream a folder as a zip archive over WebSocket in chunks, after pre-calculating the size."""
+# Shared by all folder downloads, zlib releases the GIL while compressing
+compress_executor = ThreadPoolExecutor(
+    max_workers=os.cpu_count() or 2, thread_name_prefix="zip"
+)
+
+
+async def iterate_in_thread(iterator, maxsize: int = 4):
+    """Run a blocking iterator on a worker thread and yield its items through a bounded queue.
+
+    The producer gets a thread of its own rather than a worker of the fs pool:
+    it lives as long as the transfer, and short calls (ls, stat, rm) must never
+    queue behind downloads.
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize)
+    stopped = threading.Event()
+    done = object()
+
+    def put(item):
+        asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+
+    def produce():
+        try:
+            for item in iterator:
+                if stopped.is_set():
+                    return
+                put(item)
+        except Exception as err:
+            if not stopped.is_set():
+                put(err)
+        finally:
+            if not stopped.is_set():
+                put(done)
+
+    threading.Thread(target=produce, name="fs-stream", daemon=True).start()
+    try:
+        while (item := await queue.get()) is not done:
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        # Unblock a producer waiting on the full queue so it can notice the stop
+        stopped.set()
+        while not queue.empty():
+            queue.get_nowait()
+
+
+async def stream_zip_directory(
+    ws: websockets.ClientConnection,
+    folder_path: str,
+    compression: str = "stored",
+    level: int = 6,
+    job: Job | None = None,
+):
+    """Stream a folder as a zip archive over WebSocket while the archive is being built.
+
+    ``compression`` is ``stored`` (the default, as viewers that don't ask for
+    compression expect the exact size up front), ``auto`` (deflate, but store
+    already-compressed files) or ``deflate``. The first message is the archive
+    size: exact for ``stored`` archives, ``-1`` otherwise, as the size is only
+    known at the end.
+    With a ``job``, files added and bytes sent are reported as its progress.
+    """
     try:
-        # Создаем временный буфер для zip-архива
-        with io.BytesIO() as zip_buffer:
-            # Write the zip archive to the buffer
-            with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED) as zip_file:
-                # Проходимся по файлам в директории и добавляем их в архив
-                for root, dirs, files in os.walk(folder_path):
-                    for file in files:
-                        file_path = os.path.join(root, file)
-                        archive_name = os.path.relpath(
-                            file_path, folder_path
-                        )  # relative path inside the archive
-                        zip_file.write(file_path, arcname=archive_name)
-
-            # Get the size of the entire zip archive
-            zip_buffer.seek(0, io.SEEK_END)
-            total_size = zip_buffer.tell()
-            await ws.send(str(total_size))
-
-            # Reset the buffer's position to the beginning before streaming
-            zip_buffer.seek(0)
-
-            # Stream the archive in chunks over the WebSocket
-            chunk_size = 1024 * 1024  # 1 MB chunks
-            while True:
-                chunk = zip_buffer.read(chunk_size)
-                if not chunk:
-                    break
+        if compression == "stored":
+            entries = await in_fs_thread(lambda: list(walk_files(folder_path)))
+            total_size = stored_size(entries)
+            if job:
+                job.total_files = len(entries)
+                job.total_bytes = total_size
+        else:
+            entries = walk_files(folder_path)
+            total_size = -1
+        await ws.send(str(total_size))
+
+        if job:
+            entries = counted(entries, job)
+
+        # Stream the archive in chunks over the WebSocket as it is produced, with
+        # blocks deflated in parallel on the compression pool
+        archive = stream_zip(entries, compression, level, compress_executor)
+        async with aclosing(iterate_in_thread(archive)) as chunks:
+            async for chunk in chunks:
                 await ws.send(chunk)
+                transfer_bytes.inc(len(chunk), "download")
+                if job:
+                    job.advance(nbytes=len(chunk))
 
         print(f"Теку {folder_path} відправлено на сервер.")
 
@@ -43,17 +109,52 @@ async def stream_zip_directory(ws: websockets.ClientConnection, folder_path: str
         print(f"Помилка при стрімінгу zip архіва: {err}")
 
 
-async def stream_file(ws: websockets.ClientConnection, file_path: str):
+def counted(entries, job: Job):
+    """Count archive entries as files processed by ``job`` while they are read."""
+    for entry in entries:
+        yield entry
+        job.advance(files=1)
+
+
+async def send_file_range(
+    ws: websockets.ClientConnection,
+    file_path: str,
+    offset: int,
+    length: int,
+    job: Job | None = None,
+):
+    """Send ``length`` bytes of a file starting at ``offset`` in 1 MB chunks."""
+    file = await in_fs_thread(open, file_path, "rb")
+    try:
+        file.seek(offset)
+        remaining = length
+        while remaining > 0:
+            chunk = await in_fs_thread(file.read, min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            await ws.send(chunk)
+            transfer_bytes.inc(len(chunk), "download")
+            if job:
+                job.advance(nbytes=len(chunk))
+    finally:
+        file.close()
+
+
+async def stream_file(
+    ws: websockets.ClientConnection, file_path: str, job: Job | None = None
+):
     """Stream file in chunks over WebSocket."""
     try:
-        file_size = os.path.getsize(file_path)
+        file_size = await in_fs_thread(os.path.getsize, file_path)
+        if job:
+            job.total_files = 1
+            job.total_bytes = file_size
         # Send file size first
         await ws.send(str(file_size))
 
         # Stream the file in chunks
-        with open(file_path, "rb") as file:
-            while chunk := file.read(1024 * 1024):  # Stream by 1 MB chunks
-                await ws.send(chunk)
+        await send_file_range(ws, file_path, 0, file_size, job)
 
         print(f"Файл {file_path} відправлено на сервер.")
 
@@ -61,24 +162,121 @@ async def stream_file(ws: websockets.ClientConnection, file_path: str):
         print(f"Помилка при стрімінгу файла: {err}")
 
 
+async def connect_download(connector: Connector, channel: str):
+    # Retried while the relay is briefly unreachable; a transfer that breaks
+    # midway is resumed by the viewer with a ranged request from its offset
+    return await connect_with_backoff(
+        lambda: connector.connect(channel, BULK, header=True),
+        f"завантаження {channel}",
+        attempts=CONNECT_ATTEMPTS,
+    )
+
+
+def split_range(offset: int, length: int, parts: int) -> list[tuple[int, int]]:
+    """Split a byte range into up to ``parts`` disjoint (offset, length) ranges on chunk boundaries."""
+    chunks = max(1, -(-length // CHUNK_SIZE))
+    per_part = -(-chunks // max(1, parts)) * CHUNK_SIZE
+    return [
+        (start, min(per_part, offset + length - start))
+        for start in range(offset, offset + length, per_part)
+    ] or [(offset, 0)]
+
+
+async def stream_file_range(
+    connector: Connector,
+    channel: str,
+    file_path: str,
+    offset: int,
+    length: int,
+    job: Job | None = None,
+):
+    """Stream one byte range of a file over its own stream channel.
+
+    The first message is a JSON header with the full file size and the range
+    that follows, so the viewer can place the bytes and resume from any offset.
+    """
+    try:
+        ws = await connect_download(connector, channel)
+        try:
+            file_size = await in_fs_thread(os.path.getsize, file_path)
+            await ws.send(
+                json.dumps({"size": file_size, "offset": offset, "length": length})
+            )
+            await send_file_range(ws, file_path, offset, length, job)
+        finally:
+            await ws.close()
+
+    except Exception as err:
+        print(f"Помилка при стрімінгу частини файла: {err}")
+
+
+async def stream_file_ranges(
+    message, connector: Connector, file_path: str, job: Job | None = None
+):
+    """Handle a ranged 'download': resume from ``offset``, limit to ``length`` and
+    optionally spread the range over several parallel ``channels``.
+
+    With more than one channel each connects as ``<requestId>:<index>``.
+    """
+    request_id = message["requestId"]
+    file_size = await in_fs_thread(os.path.getsize, file_path)
+    offset = min(max(int(message.get("offset", 0)), 0), file_size)
+    length = file_size - offset
+    if message.get("length") is not None:
+        length = min(max(int(message["length"]), 0), length)
+    channels = min(max(int(message.get("channels", 1)), 1), MAX_CHANNELS)
+    if job:
+        job.total_files = 1
+        job.total_bytes = length
+
+    ranges = split_range(offset, length, channels)
+    await asyncio.gather(
+        *(
+            stream_file_range(
+                connector,
+                request_id if len(ranges) == 1 else f"{request_id}:{index}",
+                file_path,
+                start,
+                size,
+                job,
+            )
+            for index, (start, size) in enumerate(ranges)
+        )
+    )
+    print(f"Файл {file_path} відправлено на сервер.")
+
+
 async def handle_download_request(
-    message, base: str, stream_endpoint: str, session_id: str
+    message, base: str, connector: Connector, job: Job | None = None
 ):
     """Handle 'download' request: connect to WebSocket and stream file or folder as ZIP."""
     request_id = message["requestId"]
     url = message["url"]
     path = url.replace("root", base)
 
-    websocket_url = f"{stream_endpoint}/{session_id}"
+    is_file = await in_fs_thread(os.path.isfile, path)
+    is_dir = not is_file and await in_fs_thread(os.path.isdir, path)
 
-    async with websockets.connect(
-        websocket_url, additional_headers={"X-Stream-Channel": request_id}
-    ) as ws:
+    # Ranged, resumed or multi-channel file download
+    if is_file and any(key in message for key in ("offset", "length", "channels")):
+        await stream_file_ranges(message, connector, path, job)
+        return
+
+    ws = await connect_download(connector, request_id)
+    try:
         # Если это файл, стримим файл
-        if os.path.isfile(path):
-            await stream_file(ws, path)
+        if is_file:
+            await stream_file(ws, path, job)
         # Если это папка, стримим папку как zip-архив
-        elif os.path.isdir(path):
-            await stream_zip_directory(ws, path)
+        elif is_dir:
+            await stream_zip_directory(
+                ws,
+                path,
+                message.get("compression", "stored"),
+                int(message.get("level", 6)),
+                job,
+            )
         else:
             print(f"Шлях {path} не є файлом або текою.")
+    finally:
+        await ws.close()
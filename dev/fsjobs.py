@@ -0,0 +1,228 @@
+import asyncio
+import errno
+import json
+import os
+import shutil
+import stat
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Awaitable, Callable
+
+from rich import print
+from send2trash import send2trash
+
+COPY_CHUNK = 1024 * 1024
+
+# Shared by every blocking filesystem call (stat, scandir, walk, reads, rm, mv),
+# so a slow disk or a huge move can't starve the event loop or grow threads
+# without bound. Streamed transfers run on threads of their own, see
+# ``filestream.iterate_in_thread``
+fs_executor = ThreadPoolExecutor(
+    max_workers=min(32, (os.cpu_count() or 2) * 4), thread_name_prefix="fs"
+)
+
+
+async def in_fs_thread(func, *args, **kwargs):
+    """Run a blocking filesystem call on the shared pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(fs_executor, partial(func, *args, **kwargs))
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job:
+    """Progress and cancellation flag of one long filesystem operation.
+
+    Worker threads call ``advance`` as they go and ``check`` between files, so a
+    cancelled job stops at the next file or chunk boundary.
+    """
+
+    def __init__(self, request_id: str, operation: str):
+        self.request_id = request_id
+        self.operation = operation
+        self.cancelled = threading.Event()
+        self.task: asyncio.Task | None = None
+        self.files = 0
+        self.bytes = 0
+        self.total_files: int | None = None
+        self.total_bytes: int | None = None
+
+    def check(self):
+        if self.cancelled.is_set():
+            raise JobCancelled(self.request_id)
+
+    def advance(self, files: int = 0, nbytes: int = 0):
+        self.files += files
+        self.bytes += nbytes
+        self.check()
+
+    def progress(self, done: bool = False) -> dict:
+        return {
+            "requestId": self.request_id,
+            "event": "progress",
+            "operation": self.operation,
+            "files": self.files,
+            "bytes": self.bytes,
+            "totalFiles": self.total_files,
+            "totalBytes": self.total_bytes,
+            "done": done,
+        }
+
+
+class Jobs:
+    """Running filesystem jobs by request id, with periodic progress events.
+
+    A 'cancel' request sets the job's flag for its worker threads and cancels
+    its task, which also stops async work such as a folder download.
+    """
+
+    def __init__(self, interval: float = 0.5):
+        self.interval = interval
+        self.running: dict[str, Job] = {}
+
+    async def run(
+        self,
+        ws,
+        request_id: str,
+        operation: str,
+        work: Callable[[Job], Awaitable],
+    ):
+        job = Job(request_id, operation)
+        self.running[request_id] = job
+        job.task = asyncio.create_task(work(job))
+        try:
+            while True:
+                done, _ = await asyncio.wait({job.task}, timeout=self.interval)
+                if done:
+                    break
+                await ws.send(json.dumps(job.progress()))
+            if job.task.cancelled():
+                raise JobCancelled(request_id)
+            result = job.task.result()
+            await ws.send(json.dumps(job.progress(done=True)))
+            return result
+        except asyncio.CancelledError:
+            # The request itself was cancelled (connection closed): stop the job too
+            job.cancelled.set()
+            job.task.cancel()
+            raise
+        finally:
+            self.running.pop(request_id, None)
+
+    def cancel(self, request_id: str) -> bool:
+        job = self.running.get(request_id)
+        if job is None:
+            return False
+        job.cancelled.set()
+        job.task.cancel()
+        return True
+
+    def close(self):
+        for request_id in list(self.running):
+            self.cancel(request_id)
+
+
+def tree_size(path: str, job: Job):
+    """Fill in ``job``'s totals with the number and size of files under ``path``."""
+    files = 0
+    size = 0
+    if os.path.isdir(path) and not os.path.islink(path):
+        for root, _, names in os.walk(path):
+            for name in names:
+                try:
+                    stat_info = os.lstat(os.path.join(root, name))
+                except OSError:
+                    continue
+                files += 1
+                # Links are recreated, not copied
+                size += 0 if stat.S_ISLNK(stat_info.st_mode) else stat_info.st_size
+            job.check()
+    else:
+        files = 1
+        size = os.lstat(path).st_size
+    job.total_files = files
+    job.total_bytes = size
+
+
+def trash(job: Job, path: str):
+    # Moving to the trash is a rename, only cancellable before it starts
+    job.check()
+    send2trash(path)
+    job.advance(files=1)
+
+
+def copy_file(job: Job, source: str, destination: str):
+    with open(source, "rb") as src, open(destination, "wb") as dst:
+        while chunk := src.read(COPY_CHUNK):
+            dst.write(chunk)
+            job.advance(nbytes=len(chunk))
+    shutil.copystat(source, destination)
+    job.advance(files=1)
+
+
+def copy_tree(job: Job, source: str, destination: str):
+    if os.path.islink(source):
+        os.symlink(os.readlink(source), destination)
+        job.advance(files=1)
+        return
+    if not os.path.isdir(source):
+        copy_file(job, source, destination)
+        return
+    for root, dirs, names in os.walk(source):
+        target = os.path.join(destination, os.path.relpath(root, source))
+        os.makedirs(target, exist_ok=True)
+        for name in names:
+            copy_tree(job, os.path.join(root, name), os.path.join(target, name))
+        # Linked folders are recreated as links, never followed
+        for name in [name for name in dirs if os.path.islink(os.path.join(root, name))]:
+            dirs.remove(name)
+            copy_tree(job, os.path.join(root, name), os.path.join(target, name))
+        shutil.copystat(root, target)
+
+
+def remove(path: str):
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path, ignore_errors=True)
+    elif os.path.lexists(path):
+        os.remove(path)
+
+
+def move(job: Job, source: str, destination: str):
+    """``shutil.move`` with progress and cancellation.
+
+    A rename is instant on the same device; across devices the tree is copied
+    chunk by chunk and the source removed only once the copy is complete, so a
+    cancelled move leaves the source intact and removes the partial copy. An
+    existing destination file is overwritten, like ``shutil.move`` does.
+    """
+    if os.path.isdir(destination):
+        destination = os.path.join(
+            destination, os.path.basename(source.rstrip(os.sep))
+        )
+
+    job.check()
+    try:
+        os.replace(source, destination)
+        job.advance(files=1)
+        return
+    except OSError as err:
+        if err.errno != errno.EXDEV:
+            raise
+
+    tree_size(source, job)
+    started = time.perf_counter()
+    if os.path.islink(destination) or os.path.isfile(destination):
+        os.remove(destination)  # replaced, as the rename above would have
+    try:
+        copy_tree(job, source, destination)
+    except BaseException:
+        remove(destination)
+        raise
+    remove(source)
+    print(
+        f"{source} переміщено на інший диск за {time.perf_counter() - started:.1f} с"
+    )
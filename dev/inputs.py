@@ -0,0 +1,226 @@
+import queue
+import struct
+import threading
+from functools import partial
+from typing import Callable
+
+from mux import CONTROL, Connector
+from pynput.keyboard import Controller, Key, KeyCode
+from pynput.mouse import Button
+from pynput.mouse import Controller as MouseController
+from reconnect import Backoff, connect_with_backoff
+from rich import print
+from rich.traceback import Traceback
+from websockets.exceptions import ConnectionClosed
+
+# Binary input batch, sent by the viewer on the ``input`` channel:
+#   header  <BB     version (1), monitor index
+#   events  <BBHff  kind, button/flags, key, x, y   (12 bytes each)
+# Coordinates are normalized to the monitor's stream like 'mouseClick'; for
+# SCROLL they are the horizontal and vertical steps instead.
+BATCH = struct.Struct("<BB")
+EVENT = struct.Struct("<BBHff")
+VERSION = 1
+
+MOVE = 1
+BUTTON_DOWN = 2
+BUTTON_UP = 3
+CLICK = 4
+SCROLL = 5
+KEY_DOWN = 6
+KEY_UP = 7
+
+# Key events carry a unicode code point when FLAG_CHAR is set, otherwise an
+# index into KEY_NAMES (the viewer gets the table with the channel)
+FLAG_CHAR = 1
+
+BUTTONS = {1: Button.left, 2: Button.right, 3: Button.middle}
+
+KEY_NAMES = (
+    "alt", "alt_l", "alt_r", "alt_gr", "backspace", "caps_lock",
+    "cmd", "cmd_l", "cmd_r", "ctrl", "ctrl_l", "ctrl_r", "delete",
+    "down", "end", "enter", "esc", "home", "left", "page_down", "page_up",
+    "right", "shift", "shift_l", "shift_r", "space", "tab", "up",
+    "insert", "menu", "num_lock", "pause", "print_screen", "scroll_lock",
+    *(f"f{number}" for number in range(1, 21)),
+)  # fmt: skip
+
+# Keys missing on this platform (e.g. insert on macOS) are None
+KEY_TABLE = [getattr(Key, name, None) for name in KEY_NAMES]
+
+# KeyboardEvent.code of the viewer's 'keypress' events -> pynput key
+BROWSER_KEYS = {
+    "ShiftLeft": Key.shift_l, "ShiftRight": Key.shift_r,
+    "ControlLeft": Key.ctrl_l, "ControlRight": Key.ctrl_r,
+    "AltLeft": Key.alt_l, "AltRight": Key.alt_r,
+    "MetaLeft": Key.cmd_l, "MetaRight": Key.cmd_r,
+    "ArrowUp": Key.up, "ArrowDown": Key.down,
+    "ArrowLeft": Key.left, "ArrowRight": Key.right,
+    "CapsLock": Key.caps_lock, "Enter": Key.enter, "NumpadEnter": Key.enter,
+    "Escape": Key.esc, "Backspace": Key.backspace, "Tab": Key.tab,
+    "Space": Key.space, "Delete": Key.delete, "Home": Key.home, "End": Key.end,
+    "PageUp": Key.page_up, "PageDown": Key.page_down,
+    **{
+        code: key
+        for code, name in (
+            ("Insert", "insert"), ("ContextMenu", "menu"),
+            ("NumLock", "num_lock"), ("Pause", "pause"),
+            ("PrintScreen", "print_screen"), ("ScrollLock", "scroll_lock"),
+            *((f"F{number}", f"f{number}") for number in range(1, 21)),
+        )
+        if (key := getattr(Key, name, None))
+    },
+}  # fmt: skip
+
+MODIFIERS = {
+    "shift": Key.shift,
+    "control": Key.ctrl,
+    "meta": Key.cmd,
+    "alt": Key.alt,
+}
+
+keyboard = Controller()
+mouse = MouseController()
+
+
+def press_key(event: dict):
+    """Inject one 'keypress' event, with its modifiers held around it."""
+    key = BROWSER_KEYS.get(event["keyCode"], event["key"])
+    modifiers = [MODIFIERS[mod] for mod in event["modifiers"] if mod in MODIFIERS]
+
+    for modifier in modifiers:
+        keyboard.press(modifier)
+
+    # Perform key press or release action
+    if event["action"] == "down":
+        keyboard.press(key)
+    elif event["action"] == "up":
+        keyboard.release(key)
+
+    for modifier in modifiers:
+        keyboard.release(modifier)
+
+
+def click(x: float, y: float, aux: bool):
+    mouse.position = (round(x), round(y))
+    mouse.click(Button.left if not aux else Button.right)
+
+
+def decode(batch: bytes) -> tuple[int, list[tuple]]:
+    version, monitor = BATCH.unpack_from(batch)
+    if version != VERSION:
+        raise ValueError(f"Невідома версія пакета вводу: {version}")
+    body = memoryview(batch)[BATCH.size :]
+    body = body[: len(body) - len(body) % EVENT.size]
+    return monitor, list(EVENT.iter_unpack(body))
+
+
+class InputInjector:
+    """Inject mouse and keyboard events in order from one dedicated thread.
+
+    Binary batches and single calls ('mouseClick', 'keypress') share the
+    queue, so events are applied exactly in the order they arrived. When the
+    thread falls behind, everything queued is taken at once and consecutive
+    moves collapse into the last one, so the pointer catches up instead of
+    replaying the whole path.
+    """
+
+    def __init__(self, to_screen: Callable[[int, float, float], tuple[float, float]]):
+        self.to_screen = to_screen
+        self.queue = queue.SimpleQueue()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.worker, name="input", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.queue.put(None)
+
+    def submit(self, batch: bytes):
+        self.queue.put(batch)
+
+    def call(self, func: Callable, *args):
+        self.queue.put(partial(func, *args))
+
+    def worker(self):
+        while True:
+            items = [self.queue.get()]
+            while not self.queue.empty():
+                items.append(self.queue.get_nowait())
+
+            events = []
+            for item in items:
+                if item is None:
+                    return
+                if callable(item):
+                    events.append(item)
+                    continue
+                try:
+                    monitor, records = decode(item)
+                except Exception as err:
+                    print(err)
+                    continue
+                events.extend((monitor, *record) for record in records)
+
+            for index, event in enumerate(events):
+                next_event = events[index + 1] if index + 1 < len(events) else None
+                # A move followed by another move is never seen on screen
+                if (
+                    not callable(event)
+                    and event[1] == MOVE
+                    and next_event
+                    and not callable(next_event)
+                    and next_event[1] == MOVE
+                ):
+                    continue
+                try:
+                    if callable(event):
+                        event()
+                    else:
+                        self.apply(*event)
+                except Exception as e:
+                    assert e
+                    print(Traceback(show_locals=False))
+
+    def apply(self, monitor: int, kind: int, arg: int, code: int, x: float, y: float):
+        if kind == SCROLL:
+            mouse.scroll(round(x), round(y))
+        elif kind in (KEY_DOWN, KEY_UP):
+            key = KeyCode.from_char(chr(code)) if arg & FLAG_CHAR else KEY_TABLE[code]
+            if key is None:
+                return
+            if kind == KEY_DOWN:
+                keyboard.press(key)
+            else:
+                keyboard.release(key)
+        else:
+            screen_x, screen_y = self.to_screen(monitor, x, y)
+            mouse.position = (round(screen_x), round(screen_y))
+            button = BUTTONS.get(arg, Button.left)
+            if kind == BUTTON_DOWN:
+                mouse.press(button)
+            elif kind == BUTTON_UP:
+                mouse.release(button)
+            elif kind == CLICK:
+                mouse.click(button)
+
+
+async def input_channel(connector: Connector, injector: InputInjector):
+    """Receive binary input batches on their own socket, reconnected with backoff
+    like the other channels whenever connecting fails or the socket drops."""
+    backoff = Backoff()
+    while True:
+        websocket = await connect_with_backoff(
+            lambda: connector.connect("input", CONTROL), "канал вводу", backoff
+        )
+        try:
+            async for message in websocket:
+                backoff.reset()
+                if isinstance(message, bytes):
+                    injector.submit(message)
+        except ConnectionClosed:
+            print("Канал вводу закрито.")
+        finally:
+            await websocket.close()
+        await backoff.wait()
@@ -0,0 +1,241 @@
+import fnmatch
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from contextlib import aclosing
+from typing import Callable, Iterator
+
+from filestream import iterate_in_thread
+from fsjobs import in_fs_thread
+from rich import print
+
+
+def creation_time(stat_info: os.stat_result) -> str:
+    if hasattr(stat_info, "st_birthtime"):
+        created = stat_info.st_birthtime
+    else:
+        created = stat_info.st_ctime
+    return datetime.fromtimestamp(created).isoformat()
+
+
+def iter_directory(path: str) -> Iterator[dict]:
+    """Yield listing entries in one ``scandir`` pass, reusing each entry's cached stat data."""
+    with os.scandir(path) as entries:
+        for entry in entries:
+            try:
+                stat_info = entry.stat()  # follows symlinks like os.path.isfile did
+                is_file = entry.is_file()
+            except OSError as err:
+                # Broken link or vanished entry: shown as a folder, as before
+                yield {"type": "folder", "name": entry.name, "createdAt": str(err)}
+                continue
+
+            if is_file:
+                yield {
+                    "type": "file",
+                    "name": entry.name,
+                    "bytes": stat_info.st_size,
+                    "createdAt": creation_time(stat_info),
+                }
+            else:
+                yield {
+                    "type": "folder",
+                    "name": entry.name,
+                    "createdAt": creation_time(stat_info),
+                }
+
+
+def scan_directory(path: str) -> list[dict]:
+    content = list(iter_directory(path))
+    content.sort(key=lambda x: (x["type"] == "file", x["name"]))
+    return content
+
+
+def batched(entries: Iterator[dict], size: int) -> Iterator[list[dict]]:
+    batch = []
+    for entry in entries:
+        batch.append(entry)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+SORT_KEYS = {
+    "name": lambda x: x["name"],
+    "size": lambda x: x.get("bytes", 0),
+    "date": lambda x: x["createdAt"],
+}
+
+
+def matches(name_filter: str | None) -> Callable[[dict], bool]:
+    """Case-insensitive name filter: a glob when it has wildcards, a substring otherwise."""
+    if not name_filter:
+        return lambda entry: True
+    pattern = name_filter.lower()
+    if any(char in pattern for char in "*?["):
+        return lambda entry: fnmatch.fnmatchcase(entry["name"].lower(), pattern)
+    return lambda entry: pattern in entry["name"].lower()
+
+
+def query(
+    content: list[dict],
+    sort: str = "name",
+    descending: bool = False,
+    name_filter: str | None = None,
+) -> list[dict]:
+    """Filter and sort a listing; folders always come before files."""
+    key = SORT_KEYS.get(sort, SORT_KEYS["name"])
+    keep = matches(name_filter)
+    content = [entry for entry in content if keep(entry)]
+    if sort == "name" and not descending:
+        return content  # listings are cached in this order already
+    content.sort(key=key, reverse=descending)
+    content.sort(key=lambda x: x["type"] == "file")  # stable, keeps the order above
+    return content
+
+
+class DirectoryCache:
+    """LRU cache of directory listings, validated against the directory's mtime.
+
+    Adding, removing or renaming entries bumps the directory mtime, so a hit is
+    only served while it is unchanged. File sizes can change without touching
+    the directory, so entries also expire after ``max_age`` seconds. Commands
+    that modify the tree (rm, mv, uploads) call ``invalidate`` for the parents
+    they touch.
+    """
+
+    def __init__(self, max_entries: int = 128, max_age: float = 5.0):
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.entries: OrderedDict[str, tuple[int, float, list[dict]]] = OrderedDict()
+        self.lock = threading.Lock()  # listings are built on worker threads
+
+    def get(self, path: str) -> list[dict] | None:
+        """Return the cached listing if it is still valid, without scanning."""
+        key = os.path.realpath(path)
+        mtime = os.stat(key).st_mtime_ns
+
+        with self.lock:
+            cached = self.entries.get(key)
+            if (
+                cached
+                and cached[0] == mtime
+                and time.monotonic() - cached[1] < self.max_age
+            ):
+                self.entries.move_to_end(key)
+                return cached[2]
+        return None
+
+    def store(self, path: str, mtime: int, content: list[dict]):
+        content.sort(key=lambda x: (x["type"] == "file", x["name"]))
+        with self.lock:
+            key = os.path.realpath(path)
+            self.entries[key] = (mtime, time.monotonic(), content)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def list(self, path: str) -> list[dict]:
+        content = self.get(path)
+        if content is None:
+            mtime = os.stat(path).st_mtime_ns  # taken before scanning, errs on stale
+            content = scan_directory(path)
+            self.store(path, mtime, content)
+        return content
+
+    def invalidate(self, *paths: str):
+        """Drop cached listings of ``paths`` and of the directories containing them."""
+        with self.lock:
+            for path in paths:
+                path = os.path.abspath(path)
+                self.entries.pop(os.path.realpath(path), None)
+                self.entries.pop(os.path.realpath(os.path.dirname(path)), None)
+
+
+async def handle_ls_request(ws, message, base: str, cache: DirectoryCache):
+    """Handle 'ls' request.
+
+    Optional fields: ``sort`` (name, size, date), ``order`` (asc, desc),
+    ``filter`` (substring or glob), ``offset``/``limit`` for one page of the
+    result, and ``stream`` to receive the listing in batches of ``limit``
+    (default 500); every batch is an ``ls`` event with ``done`` set on the last
+    one. Responses to paged or streamed requests carry ``total``.
+
+    A streamed listing that is not cached yet and asks for the default order
+    (by name, ascending, no offset) is sent as the directory is scanned, in
+    directory order: its batches carry ``"sorted": false``. Any other order or
+    an offset scans the whole directory first.
+    """
+    request_id = message["requestId"]
+    path = str(message["path"]).replace("root", base)
+    sort = message.get("sort", "name")
+    descending = message.get("order") == "desc"
+    name_filter = message.get("filter")
+    offset = max(int(message.get("offset", 0)), 0)
+    limit = message.get("limit")
+
+    def reply(contents: list[dict], **extra) -> str:
+        return json.dumps(
+            {
+                "requestId": request_id,
+                "event": "ls",
+                "path": message["path"],
+                "contents": contents,
+                **extra,
+            }
+        )
+
+    try:
+        if message.get("stream"):
+            batch_size = max(int(limit or 500), 1)
+            content = await in_fs_thread(cache.get, path)
+            if content is None and (sort != "name" or descending or offset):
+                content = await in_fs_thread(cache.list, path)
+            if content is not None:
+                content = await in_fs_thread(
+                    query, content, sort, descending, name_filter
+                )
+                for start in range(offset, len(content), batch_size):
+                    await ws.send(
+                        reply(content[start : start + batch_size], done=False)
+                    )
+                await ws.send(reply([], done=True, total=len(content)))
+                return
+
+            # Not cached, default order: send entries as they are scanned
+            mtime = (await in_fs_thread(os.stat, path)).st_mtime_ns
+            keep = matches(name_filter)
+            scanned = []
+            total = 0
+            async with aclosing(
+                iterate_in_thread(batched(iter_directory(path), batch_size))
+            ) as batches:
+                async for batch in batches:
+                    scanned.extend(batch)
+                    batch = [entry for entry in batch if keep(entry)]
+                    total += len(batch)
+                    if batch:
+                        await ws.send(reply(batch, done=False, sorted=False))
+            await in_fs_thread(cache.store, path, mtime, scanned)
+            await ws.send(reply([], done=True, total=total))
+            return
+
+        content = await in_fs_thread(cache.list, path)
+        if sort == "name" and not descending and not name_filter and not (
+            offset or limit is not None
+        ):
+            await ws.send(reply(content))
+            return
+
+        content = query(content, sort, descending, name_filter)
+        end = len(content) if limit is None else offset + max(int(limit), 0)
+        await ws.send(reply(content[offset:end], offset=offset, total=len(content)))
+
+    except Exception as err:
+        print(err)
+        await ws.send(reply([], done=True) if message.get("stream") else reply([]))
@@ -0,0 +1,267 @@
+import asyncio
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter as Tally
+from contextlib import contextmanager
+from typing import Iterator
+
+from rich import print
+
+# Upper bounds (seconds) of the latency histogram buckets, from sub-millisecond
+# encodes up to minute-long transfers
+BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60,
+)  # fmt: skip
+
+
+class Counter:
+    """Monotonic total per label value, safe to increment from any thread."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, label: str | None = None):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.values: dict[str, float] = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount: float = 1, label: str = ""):
+        with self.lock:
+            self.values[label] = self.values.get(label, 0) + amount
+
+    def snapshot(self) -> dict[str, float]:
+        with self.lock:
+            return dict(self.values)
+
+    def samples(self) -> Iterator[tuple[str, str, float]]:
+        for label, value in self.snapshot().items():
+            yield "_total", labels(self.label, label), value
+
+
+class Histogram:
+    """Bucketed distribution per label value, like a Prometheus histogram."""
+
+    kind = "histogram"
+
+    def __init__(
+        self, name: str, help: str, label: str | None = None, buckets=BUCKETS
+    ):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.buckets = tuple(buckets)
+        # Per label: count of every bucket (the last one is +Inf), then the sum
+        self.series: dict[str, list[float]] = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value: float, label: str = ""):
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(label)
+            if series is None:
+                series = self.series[label] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    @contextmanager
+    def time(self, label: str = ""):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, label)
+
+    def snapshot(self) -> dict[str, list[float]]:
+        with self.lock:
+            return {label: list(series) for label, series in self.series.items()}
+
+    def samples(self) -> Iterator[tuple[str, str, float]]:
+        for label, series in self.snapshot().items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), series):
+                cumulative += count
+                yield "_bucket", labels(self.label, label, le=bound), cumulative
+            yield "_count", labels(self.label, label), cumulative
+            yield "_sum", labels(self.label, label), series[-1]
+
+    def quantile(self, series: list[float], q: float) -> float:
+        """Upper bound of the bucket holding the ``q`` quantile of ``series``."""
+        total = sum(series[:-1])
+        seen = 0
+        for bound, count in zip((*self.buckets, float("inf")), series):
+            seen += count
+            if total and seen >= q * total:
+                return bound
+        return 0.0
+
+
+def labels(name: str | None, value: str, **extra) -> str:
+    pairs = {name: value} if name and value else {}
+    pairs.update((key, str(bound)) for key, bound in extra.items())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in pairs.items()) + "}"
+
+
+REGISTRY: list[Counter | Histogram] = []
+
+
+def counter(name: str, help: str, label: str | None = None) -> Counter:
+    REGISTRY.append(metric := Counter(name, help, label))
+    return metric
+
+
+def histogram(name: str, help: str, label: str | None = None) -> Histogram:
+    REGISTRY.append(metric := Histogram(name, help, label))
+    return metric
+
+
+frame_stage_seconds = histogram(
+    "dimon_frame_stage_seconds",
+    "Time per frame spent in each stage: grab, scale, convert, diff, encode, send",
+    "stage",
+)
+frames_sent = counter("dimon_frames_sent", "Frames sent to the viewer")
+frames_dropped = counter(
+    "dimon_frames_dropped", "Frames replaced or coalesced before they were sent"
+)
+frame_bytes = counter("dimon_frame_bytes", "Encoded bytes of sent frames")
+command_seconds = histogram(
+    "dimon_command_seconds",
+    "Control request latency from receipt to completion, per request type",
+    "request",
+)
+transfer_bytes = counter(
+    "dimon_transfer_bytes", "File bytes moved per transfer kind", "kind"
+)
+terminal_bytes = counter(
+    "dimon_terminal_bytes", "Bytes through terminal PTYs", "direction"
+)
+
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in REGISTRY:
+        # Counter samples carry the _total suffix, and so must their metadata
+        family = f"{metric.name}_total" if metric.kind == "counter" else metric.name
+        lines.append(f"# HELP {family} {metric.help}")
+        lines.append(f"# TYPE {family} {metric.kind}")
+        for suffix, label_text, value in metric.samples():
+            # repr keeps every digit, :g would round byte totals to 6 of them
+            lines.append(f"{metric.name}{suffix}{label_text} {float(value)!r}")
+    return "\n".join(lines) + "\n"
+
+
+async def serve(port: int, host: str = "127.0.0.1") -> asyncio.Server:
+    """Serve ``render()`` over plain HTTP for a local Prometheus scraper."""
+
+    async def respond(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request = await reader.readline()
+            while (await reader.readline()).strip():
+                pass  # headers are not needed
+            path = request.split()[1] if len(request.split()) > 1 else b"/"
+            if path.split(b"?")[0] in (b"/", b"/metrics"):
+                status, body = "200 OK", render().encode()
+            else:
+                status, body = "404 Not Found", b""
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                "Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                "Connection: close\r\n\r\n".encode()
+                + body
+            )
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(respond, host, port)
+    print(f"Метрики доступні на http://{host}:{port}/metrics")
+    return server
+
+
+async def report(interval: float):
+    """Print rates and latency quantiles of the last ``interval`` seconds, forever."""
+    previous = {metric.name: metric.snapshot() for metric in REGISTRY}
+    while True:
+        await asyncio.sleep(interval)
+        lines = []
+        for metric in REGISTRY:
+            current = metric.snapshot()
+            before = previous[metric.name]
+            previous[metric.name] = current
+            for label, value in sorted(current.items()):
+                name = f"{metric.name}{labels(metric.label, label)}"
+                if isinstance(metric, Counter):
+                    rate = (value - before.get(label, 0)) / interval
+                    if rate:
+                        lines.append(f"  {name}: {rate:,.1f}/с")
+                    continue
+                old = before.get(label, [0] * len(value))
+                window = [new - old_value for new, old_value in zip(value, old)]
+                count = sum(window[:-1])
+                if not count:
+                    continue
+                p50, p95, p99 = (metric.quantile(window, q) for q in (0.5, 0.95, 0.99))
+                lines.append(
+                    f"  {name}: {count:g} шт., середнє {window[-1] / count * 1000:.1f} мс, "
+                    f"p50≤{p50 * 1000:g} p95≤{p95 * 1000:g} p99≤{p99 * 1000:g} мс"
+                )
+        if lines:
+            print(f"Метрики за {interval:g} с:\n" + "\n".join(lines))
+
+
+class SamplingProfiler:
+    """Sample the stacks of all threads every ``interval`` seconds from a thread.
+
+    On ``stop`` the samples are written as folded stacks (``thread;frame;frame
+    count`` per line), which flamegraph.pl and speedscope open directly. Costs
+    one stack walk per thread and tick, nothing when not started.
+    """
+
+    def __init__(self, path: str, interval: float = 0.01):
+        self.path = path
+        self.interval = interval
+        self.stacks = Tally()
+        self.running = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.running.set()
+        self.thread = threading.Thread(target=self.sample, name="profiler", daemon=True)
+        self.thread.start()
+
+    def sample(self):
+        own = threading.get_ident()
+        while self.running.is_set():
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({code.co_filename}:{frame.f_lineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.stacks[";".join(reversed(stack))] += 1
+            time.sleep(self.interval)
+
+    def stop(self):
+        if not self.thread:
+            return
+        self.running.clear()
+        self.thread.join()
+        self.thread = None
+        with open(self.path, "w", encoding="utf-8") as file:
+            for stack, count in self.stacks.most_common():
+                file.write(f"{stack} {count}\n")
+        print(f"Профіль ({sum(self.stacks.values())} вибірок) записано у {self.path}")
@@ -2,343 +2,416 @@ import argparse
 import asyncio
 import json
 import os
-import shutil
-from datetime import datetime
-
-import cv2
-import mss
-import numpy as np
-import pyautogui
-import websockets
+from typing import Callable
+
+from delta import HashCache, handle_sync_request
 from directory import select_directory
+from dispatch import Dispatcher
 from filestream import handle_download_request
-from pynput.keyboard import Controller, Key
+from fsjobs import JobCancelled, Jobs, in_fs_thread, move, trash
+from inputs import KEY_NAMES, InputInjector, click, input_channel, press_key
+from listing import DirectoryCache, handle_ls_request
+from metrics import SamplingProfiler, report, serve
+from mux import CONTROL, Connector
+from quality import Bounds, parse_bounds
+from reconnect import ControlSocket
 from rich import print
 from rich.traceback import Traceback
-from send2trash import send2trash
-from websockets.exceptions import ConnectionClosed
-from terminal import TerminalSession
-
-keyboard = Controller()
+from screen import ScreenStreams
+from search import SearchIndex, handle_search_request
+from sources import FrameSource, MssSource, parse_source
+from terminal import TerminalSessions
+from upload import Uploads, handle_upload_request
 
-
-def get_creation_time(path: str) -> str:
-    try:
-        stat_info = os.stat(path)
-        if hasattr(stat_info, "st_birthtime"):
-            creation_time = stat_info.st_birthtime
-        else:
-            creation_time = stat_info.st_ctime
-        creation_time_dt = datetime.fromtimestamp(creation_time)
-        return creation_time_dt.isoformat()
-    except Exception as e:
-        return str(e)
+listing_cache = DirectoryCache()
+uploads = Uploads()
+hash_cache = HashCache()
 
 
 async def fs_commands(
-    ws: websockets.WebSocketClientProtocol,
+    ws: ControlSocket,
     base: str,
-    stream_endpoint: str,
-    session_id: str,
-    shell: str | None,
+    connector: Connector,
+    screens: ScreenStreams,
+    search_index: SearchIndex,
+    terminals: TerminalSessions,
+    injector: InputInjector,
 ):
-    terminal_session = None
-    try:
-        while True:
-            message = json.loads(await ws.recv())
-
-            # Handle 'ls' request
-            if message["request"] == "ls":
-                request_id = message["requestId"]
-                path = str(message["path"]).replace("root", base)
-                try:
-                    content = sorted(
-                        [
-                            (
-                                {
-                                    "type": "file",
-                                    "name": entry,
-                                    "bytes": os.path.getsize(f"{path}/{entry}"),
-                                    "createdAt": get_creation_time(f"{path}/{entry}"),
-                                }
-                                if os.path.isfile(f"{path}/{entry}")
-                                else {
-                                    "type": "folder",
-                                    "name": entry,
-                                    "createdAt": get_creation_time(f"{path}/{entry}"),
-                                }
-                            )
-                            for entry in os.listdir(path)
-                        ],
-                        key=lambda x: (x["type"] == "file", x["name"]),
-                    )
-                    await ws.send(
-                        json.dumps(
-                            {
-                                "requestId": request_id,
-                                "event": "ls",
-                                "path": message["path"],
-                                "contents": content,
-                            }
-                        )
-                    )
-                except Exception as err:
-                    print(err)
-                    await ws.send(
-                        json.dumps(
-                            {
-                                "requestId": request_id,
-                                "event": "ls",
-                                "path": message["path"],
-                                "contents": [],
-                            }
-                        )
-                    )
-
-            # Handle 'download' request
-            elif message["request"] == "download":
-                await handle_download_request(
-                    message, base, stream_endpoint, session_id
-                )
+    dispatcher = Dispatcher()
+    jobs = Jobs()
+    input_task = None
+
+    # Handle 'ls' request
+    async def ls(message):
+        await handle_ls_request(ws, message, base, listing_cache)
+
+    # Handle 'search' request over the background name index
+    async def search(message):
+        await handle_search_request(ws, message, search_index)
+
+    # Handle 'download' request
+    async def download(message):
+        await jobs.run(
+            ws,
+            message["requestId"],
+            "download",
+            lambda job: handle_download_request(
+                message, base, connector, job
+            ),
+        )
+
+    # Handle 'sync' request: send only what differs from the viewer's copy
+    async def sync(message):
+        await jobs.run(
+            ws,
+            message["requestId"],
+            "sync",
+            lambda job: handle_sync_request(
+                ws, message, base, connector, hash_cache, job
+            ),
+        )
+
+    # Handle 'upload' request: receive a file into the shared folder
+    async def upload(message):
+        if await jobs.run(
+            ws,
+            message["requestId"],
+            "upload",
+            lambda job: handle_upload_request(
+                ws, message, base, connector, uploads, job
+            ),
+        ):
+            listing_cache.invalidate(str(message["path"]).replace("root", base))
+            search_index.refresh()
+
+    # Handle 'monitors' request: list screens and which of them are streamed
+    async def monitors(message):
+        await ws.send(
+            json.dumps(
+                {
+                    "requestId": message["requestId"],
+                    "event": "monitors",
+                    "monitors": screens.describe(),
+                }
+            )
+        )
 
-            # Handle 'mouseClick' request
-            elif message["request"] == "mouseClick":
-                point = message["point"]
+    # Handle 'streamMonitors' request: stream exactly the given monitors
+    async def stream_monitors(message):
+        screens.select([int(index) for index in message["monitors"]])
+
+    # Handle 'keyframe' request: the viewer lost its picture (tiles mode)
+    async def keyframe(message):
+        if pipeline := screens.pipeline(message.get("monitor", 1)):
+            pipeline.request_keyframe()
+
+    # Handle 'streamView' request: output size and optional crop/zoom region
+    async def stream_view(message):
+        size = message.get("size")
+        region = message.get("region")
+        if not (pipeline := screens.pipeline(message.get("monitor", 1))):
+            return
+        pipeline.set_view(
+            (
+                (region["x"], region["y"], region["width"], region["height"])
+                if region
+                else None
+            ),
+            (size["width"], size["height"]) if size else None,
+        )
 
-                # Get the screen size
-                screen_width, screen_height = pyautogui.size()
+    # Handle 'streamStats' request: frame rate, drops and frame age
+    async def stream_stats(message):
+        await ws.send(
+            json.dumps(
+                {
+                    "requestId": message["requestId"],
+                    "event": "streamStats",
+                    "stats": {
+                        index: sender.stats.last
+                        for index, sender in screens.senders.items()
+                    },
+                }
+            )
+        )
 
-                # Normalize the x and y coordinates
-                x = point["x"] * screen_width
-                y = point["y"] * screen_height
+    # Handle 'mouseClick' request
+    async def mouse_click(message):
+        point = message["point"]
+
+        # Map the normalized point into the clicked monitor's part of the
+        # virtual desktop (mss and pynput share the same coordinate space)
+        x, y = screens.to_screen(message.get("monitor", 1), point["x"], point["y"])
+
+        # Perform the mouse click at the calculated position
+        injector.call(click, x, y, message["aux"])
+
+    async def keypress(message):
+        injector.call(press_key, message["event"])
+
+    # Handle 'inputChannel' request: batched binary input on its own socket
+    async def open_input_channel(message):
+        nonlocal input_task
+        if input_task is None or input_task.done():
+            input_task = asyncio.create_task(input_channel(connector, injector))
+        await ws.send(
+            json.dumps(
+                {
+                    "requestId": message["requestId"],
+                    "event": "inputChannel",
+                    "keys": KEY_NAMES,
+                }
+            )
+        )
 
-                # Perform the mouse click at the calculated position
-                pyautogui.click(
-                    x,
-                    y,
-                    button=(
-                        pyautogui.PRIMARY if not message["aux"] else pyautogui.SECONDARY
-                    ),
+    # Handle 'rm' (remove file/folder) request
+    async def rm(message):
+        request_id = message["requestId"]
+        path = str(message["path"]).replace("root", base)
+
+        try:
+            # Use send2trash to move the file/folder to the trash
+            await jobs.run(
+                ws,
+                request_id,
+                "rm",
+                lambda job: in_fs_thread(trash, job, os.path.abspath(path)),
+            )
+            listing_cache.invalidate(path)
+            search_index.refresh()
+            await ws.send(
+                json.dumps(
+                    {
+                        "requestId": request_id,
+                        "event": "rm",
+                        "success": True,
+                    }
                 )
+            )
+        except Exception as err:
+            print(err)
+            await ws.send(
+                json.dumps(
+                    {
+                        "requestId": request_id,
+                        "event": "rm",
+                        "success": False,
+                        "cancelled": isinstance(err, JobCancelled),
+                    }
+                )
+            )
+
+    async def mv(message):
+        request_id = message["requestId"]
+        source = str(message["url"]).replace("root", base)
+        destination = str(message["destinationUrl"]).replace("root", base)
+
+        try:
+            print(source, destination)
+            await jobs.run(
+                ws,
+                request_id,
+                "mv",
+                lambda job: in_fs_thread(move, job, source, destination),
+            )
+            listing_cache.invalidate(source, destination)
+            search_index.refresh()
+            await ws.send(
+                json.dumps(
+                    {
+                        "requestId": request_id,
+                        "event": "mv",
+                        "success": True,
+                    }
+                )
+            )
+        except Exception as err:
+            print(err)
+            await ws.send(
+                json.dumps(
+                    {
+                        "requestId": request_id,
+                        "event": "mv",
+                        "success": False,
+                        "cancelled": isinstance(err, JobCancelled),
+                    }
+                )
+            )
+
+    # Handle 'cancel' request: stop a running rm, mv or download
+    async def cancel(message):
+        await ws.send(
+            json.dumps(
+                {
+                    "requestId": message["requestId"],
+                    "event": "cancel",
+                    "success": jobs.cancel(message["target"]),
+                }
+            )
+        )
 
-            elif message["request"] == "keypress":
-                event = message["event"]
-                action = event["action"]
-                nya = (
-                    event["keyCode"]
-                    .replace("Right", "_r")
-                    .replace("Left", "_l")
-                    .replace("Meta", "cmd")
-                    .replace("Arrow_r", "right")
-                    .replace("Arrow_l", "left")
-                    .replace("Arrow", "")
-                    .replace("Caps", "caps_")
-                    .lower()
+    async def terminal(message):
+        # Handle terminal events; ``session`` names one of several shells
+        event = message.get("event", {})
+        action = event.get("action")
+        name = str(event.get("session", "default"))
+
+        print(f"Received terminal action: {action}")
+        if action == "open":
+            columns = event.get("columns", 80)
+            lines = event.get("lines", 24)
+
+            # Establish a new WebSocket connection for terminal
+            channel = "terminal" if name == "default" else f"terminal-{name}"
+
+            try:
+                terminal_ws = await connector.connect(channel, CONTROL)
+                print(f"Connected to terminal WebSocket at {connector.uri(channel)}")
+                # Reattaches and replays the scrollback if the shell is still running
+                await terminals.open(name, terminal_ws, columns, lines)
+
+            except Exception as e:
+                print(f"Failed to connect to terminal WebSocket: {e}")
+
+        elif action == "sync":
+            columns = event.get("columns")
+            lines = event.get("lines")
+            if columns and lines:
+                await terminals.resize(name, columns, lines)
+
+        elif action == "close":
+            try:
+                await terminals.close(name)
+            except Exception as e:
+                print(f"Failed to close terminal session: {e}")
+                assert e
+
+        elif action == "list":
+            await ws.send(
+                json.dumps(
+                    {
+                        "requestId": message.get("requestId"),
+                        "event": "terminalSessions",
+                        "sessions": terminals.describe(),
+                    }
                 )
-                key = getattr(Key, nya, event["key"])
-
-                modifiers = event["modifiers"]
-
-                try:
-                    # Apply modifiers
-                    for mod in modifiers:
-                        if mod == "shift":
-                            keyboard.press(Key.shift)
-                        elif mod == "control":
-                            keyboard.press(Key.ctrl)
-                        elif mod == "meta":
-                            keyboard.press(Key.cmd)
-                        elif mod == "alt":
-                            keyboard.press(Key.alt)
-
-                    # Perform key press or release action
-                    if action == "down":
-                        keyboard.press(key)
-                    elif action == "up":
-                        keyboard.release(key)
-
-                    # Release modifiers
-                    for mod in modifiers:
-                        if mod == "shift":
-                            keyboard.release(Key.shift)
-                        elif mod == "control":
-                            keyboard.release(Key.ctrl)
-                        elif mod == "meta":
-                            keyboard.release(Key.cmd)
-                        elif mod == "alt":
-                            keyboard.release(Key.alt)
-
-                except Exception as e:
-                    assert e
-                    print(Traceback(show_locals=True))
-                    continue
-
-            # Handle 'rm' (remove file/folder) request
-            elif message["request"] == "rm":
-                request_id = message["requestId"]
-                path = str(message["path"]).replace("root", base)
-
-                try:
-                    # Use send2trash to move the file/folder to the trash
-                    send2trash(os.path.abspath(path))
-                    await ws.send(
-                        json.dumps(
-                            {
-                                "requestId": request_id,
-                                "event": "rm",
-                                "success": True,
-                            }
-                        )
-                    )
-                except Exception as err:
-                    print(err)
-                    await ws.send(
-                        json.dumps(
-                            {
-                                "requestId": request_id,
-                                "event": "rm",
-                                "success": False,
-                            }
-                        )
-                    )
-
-            elif message["request"] == "mv":
-                request_id = message["requestId"]
-                source = str(message["url"]).replace("root", base)
-                destination = str(message["destinationUrl"]).replace("root", base)
-
-                try:
-                    print(source, destination)
-                    shutil.move(source, destination)
-                    await ws.send(
-                        json.dumps(
-                            {
-                                "requestId": request_id,
-                                "event": "mv",
-                                "success": True,
-                            }
-                        )
-                    )
-                except Exception as err:
-                    print(err)
-                    await ws.send(
-                        json.dumps(
-                            {
-                                "requestId": request_id,
-                                "event": "mv",
-                                "success": False,
-                            }
-                        )
-                    )
-
-            elif message["request"] == "terminal":
-                # Handle terminal events
-                event = message.get("event", {})
-                action = event.get("action")
-
-                print(f"Received terminal action: {action}")
-                if action == "open":
-                    if terminal_session and terminal_session.active:
-                        await terminal_session.close()
-
-                    columns = event.get("columns", 80)
-                    lines = event.get("lines", 24)
-
-                    # Establish a new WebSocket connection for terminal
-                    terminal_uri = f"{stream_endpoint}/{session_id}?channel=terminal"
-
-                    try:
-                        terminal_ws = await websockets.connect(terminal_uri)
-                        print(f"Connected to terminal WebSocket at {terminal_uri}")
-                        terminal_session = TerminalSession(terminal_ws, base, shell)
-                        await terminal_session.start(columns, lines)
-
-                    except Exception as e:
-                        print(f"Failed to connect to terminal WebSocket: {e}")
-
-                elif action == "sync":
-                    if terminal_session and terminal_session.active:
-                        columns = event.get("columns")
-                        lines = event.get("lines")
-                        if columns and lines:
-                            await terminal_session.set_terminal_size(columns, lines)
-
-                elif action == "close":
-                    if terminal_session and terminal_session.active:
-                        try:
-                            await terminal_session.close()
-                        except Exception as e:
-                            print(f"Failed to close terminal session: {e}")
-                            assert e
-                        terminal_session = None
+            )
+
+    # Input events keep their order on a lane of their own, so they are never
+    # queued behind transfers; blocking filesystem requests are capped per type
+    dispatcher.register("mouseClick", mouse_click, lane="input")
+    dispatcher.register("keypress", keypress, lane="input")
+    dispatcher.register("inputChannel", open_input_channel)
+    dispatcher.register("terminal", terminal, lane="terminal")
+    dispatcher.register("ls", ls, limit=4)
+    dispatcher.register("search", search, limit=4)
+    dispatcher.register("download", download, limit=4)
+    dispatcher.register("sync", sync, limit=4)
+    dispatcher.register("upload", upload, limit=4)
+    dispatcher.register("rm", rm, limit=2)
+    dispatcher.register("mv", mv, limit=2)
+    dispatcher.register("cancel", cancel)
+    dispatcher.register("monitors", monitors)
+    dispatcher.register("streamMonitors", stream_monitors)
+    dispatcher.register("keyframe", keyframe)
+    dispatcher.register("streamView", stream_view)
+    dispatcher.register("streamStats", stream_stats)
+
+    try:
+        while True:
+            dispatcher.dispatch(json.loads(await ws.recv()))
 
     except Exception as err:
         assert err
         print(Traceback(show_locals=True))
-        if terminal_session and terminal_session.active:
-            await terminal_session.close()
+    finally:
+        jobs.close()
+        if input_task:
+            input_task.cancel()
+        await dispatcher.close()
 
 
-async def stream(session_id: str, stream_endpoint: str):
-    uri = f"{stream_endpoint}/{session_id}"  # WebSocket server URI
-    async with websockets.connect(uri) as websocket:
-        with mss.mss() as sct:
-            monitor = sct.monitors[1]  # Capture the first monitor
-            encode_param = [
-                int(cv2.IMWRITE_JPEG_QUALITY),
-                30,
-            ]  # JPEG quality (0 to 100)
+async def main(
+    accept_endpoint: str,
+    stream_endpoint: str,
+    admin_endpoint: str,
+    shell: str | None,
+    folder: str | None,
+    codec: str,
+    bitrate: int,
+    quality: Bounds,
+    fps: Bounds,
+    scale: Bounds,
+    multiplexed: bool,
+    metrics_port: int | None = None,
+    stats_interval: float | None = None,
+    profile: str | None = None,
+    source: Callable[[], FrameSource] = MssSource,
+):
+    if folder is None:
+        print("Виберіть папку, до якої буде надано повний доступ")
 
-            while True:
-                # Capture the screen
-                img = sct.grab(monitor)
-                frame = np.array(img)
+    base = folder or select_directory()
+    connector = None
 
-                # Convert BGRA to BGR (opencv uses BGR format)
-                frame = cv2.cvtColor(frame, cv2.COLOR_BGRA2BGR)
+    def on_session(session_id: str):
+        print(
+            f"Посилання для дистанційного керування вашим комп'ютером: {admin_endpoint}/#/{session_id}"
+        )
+        # The relay could not resume the old session: channels reconnect to the new one
+        if connector:
+            connector.session_id = session_id
 
-                # Encode frame as JPEG
-                result, encoded_img = cv2.imencode(".jpg", frame, encode_param)
-                if not result:
-                    continue
+    # The control socket reconnects with backoff and asks to resume its session
+    control = ControlSocket(accept_endpoint, on_session)
+    session_id = await control.connect()
 
-                # Convert to bytes
-                img_bytes = encoded_img.tobytes()
+    # Every feature channel is its own socket, or one channel of a shared one
+    connector = Connector(stream_endpoint, session_id, multiplexed)
 
-                # Send over WebSocket
-                try:
-                    await websocket.send(img_bytes)
-                except ConnectionClosed:
-                    print("Connection closed")
-                    websocket = await websockets.connect(uri)
+    screens = ScreenStreams(connector, codec, bitrate, quality, fps, scale, source)
+    screens.select([1])  # Capture the first monitor until the viewer asks for more
 
-                # Control frame rate (e.g., 60 FPS)
-                await asyncio.sleep(1 / 60)
+    search_index = SearchIndex(base)
+    search_index.start()
 
+    # Mouse and keyboard events are injected from their own thread
+    injector = InputInjector(screens.to_screen)
+    injector.start()
 
-async def main(
-    accept_endpoint: str, stream_endpoint: str, admin_endpoint: str, shell: str | None, folder: str | None
-):
-    if folder is None:
-        print("Виберіть папку, до якої буде надано повний доступ")
+    # Shells survive the viewer's terminal (and control) socket reconnecting
+    terminals = TerminalSessions(base, shell)
 
-    base = folder or select_directory()
-    websocket_accept = await websockets.connect(accept_endpoint)
-    message = await websocket_accept.recv()
-
-    data = json.loads(message)
-    session_id = data["id"]
-    print(
-        f"Посилання для дистанційного керування вашим комп'ютером: {admin_endpoint}/#/{session_id}"
-    )
+    # Observability is opt-in: a local scrape endpoint, a periodic dump, a profiler
+    metrics_server = await serve(metrics_port) if metrics_port else None
+    report_task = asyncio.create_task(report(stats_interval)) if stats_interval else None
+    profiler = SamplingProfiler(profile) if profile else None
+    if profiler:
+        profiler.start()
 
-    # Create tasks for handling file system commands and streaming
-    task1 = asyncio.create_task(
-        fs_commands(websocket_accept, base, stream_endpoint, session_id, shell)
-    )
-    task2 = asyncio.create_task(stream(session_id, stream_endpoint))
-
-    await asyncio.gather(task1, task2)
+    # Handle file system commands, monitor streams run as their own tasks
+    try:
+        await fs_commands(
+            control,
+            base,
+            connector,
+            screens,
+            search_index,
+            terminals,
+            injector,
+        )
+    finally:
+        if profiler:
+            profiler.stop()
+        if report_task:
+            report_task.cancel()
+        if metrics_server:
+            metrics_server.close()
+        injector.stop()
+        search_index.stop()
+        await terminals.close_all()
+        await connector.close()
+        await control.close()
 
 
 if __name__ == "__main__":
@@ -373,6 +446,66 @@ if __name__ == "__main__":
     )
     
     parser.add_argument("--folder", default=None, help="m")
+    parser.add_argument(
+        "--codec",
+        default="mjpeg",
+        choices=["mjpeg", "tiles", "h264", "vp8"],
+        help="Формат відеопотоку: mjpeg (повні кадри), tiles (лише змінені ділянки), "
+        "h264 або vp8 (відеокодек, за відсутності енкодера - mjpeg)",
+    )
+    parser.add_argument(
+        "--bitrate",
+        type=int,
+        default=2_000_000,
+        help="Бітрейт для h264/vp8 у біт/с (дефолт: 2000000)",
+    )
+    parser.add_argument(
+        "--quality",
+        type=parse_bounds,
+        default=Bounds(20, 80),
+        help="Межі якості JPEG, підбирається автоматично (дефолт: 20-80)",
+    )
+    parser.add_argument(
+        "--fps",
+        type=parse_bounds,
+        default=Bounds(5, 60),
+        help="Межі частоти кадрів (дефолт: 5-60)",
+    )
+    parser.add_argument(
+        "--scale",
+        type=parse_bounds,
+        default=Bounds(0.5, 1),
+        help="Межі масштабу зображення відносно екрана (дефолт: 0.5-1)",
+    )
+    parser.add_argument(
+        "--source",
+        type=parse_source,
+        default="mss",
+        help="Джерело кадрів: mss (екран), synthetic[:motion|text|static[:ШxВ]] "
+        "або replay:ШЛЯХ (запис, зроблений sources.py)",
+    )
+    parser.add_argument(
+        "--mux",
+        action="store_true",
+        help="Передавати відео, файли, термінал і ввід каналами одного з'єднання",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        default=None,
+        help="Віддавати метрики у форматі Prometheus на 127.0.0.1:<порт>/metrics",
+    )
+    parser.add_argument(
+        "--stats-interval",
+        type=float,
+        default=None,
+        help="Виводити метрики кожні N секунд",
+    )
+    parser.add_argument(
+        "--profile",
+        default=None,
+        help="Записати профіль (folded stacks для flamegraph/speedscope) у файл при виході",
+    )
 
     args = parser.parse_args()
 
@@ -384,6 +517,16 @@ if __name__ == "__main__":
             f"{protocol}://{args.stream}",
             args.admin,
             args.shell,
-            args.folder
+            args.folder,
+            args.codec,
+            args.bitrate,
+            args.quality,
+            args.fps,
+            args.scale,
+            args.mux,
+            args.metrics_port,
+            args.stats_interval,
+            args.profile,
+            args.source,
         )
     )
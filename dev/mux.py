@@ -0,0 +1,293 @@
+import asyncio
+import struct
+from collections import deque
+
+import websockets
+import websockets.asyncio.client
+from rich import print
+from websockets.exceptions import ConnectionClosed
+
+# Every websocket message of the multiplexed connection holds one or more frames:
+#   <BBHI  type, flags, channel id, payload length, then the payload
+# OPEN carries the channel name (what used to be the ``?channel=`` of its own
+# socket), CREDIT a u32 of bytes the receiver is ready to take. A message larger
+# than MAX_FRAME is split into frames flagged FLAG_MORE except for the last.
+FRAME = struct.Struct("<BBHI")
+CREDIT_SIZE = struct.Struct("<I")
+
+OPEN = 1
+DATA = 2
+CLOSE = 3
+CREDIT = 4
+
+FLAG_TEXT = 1
+FLAG_MORE = 2
+
+MAX_FRAME = 64 * 1024
+MAX_MESSAGE = 256 * 1024
+WINDOW = 1024 * 1024  # initial credit of every channel, in each direction
+
+# Lower is sent first: input and control never wait behind video, video never
+# waits behind a bulk transfer for more than one frame
+CONTROL = 0
+VIDEO = 1
+BULK = 2
+
+
+class MuxChannel:
+    """One logical socket of a ``Multiplexer``, used like a websocket connection.
+
+    ``send`` waits for credit from the other end and returns once the message
+    has been handed to the shared socket, so a slow channel only throttles
+    itself. Received messages are acknowledged with credit as they are read.
+    """
+
+    def __init__(self, mux: "Multiplexer", channel_id: int, name: str, priority: int):
+        self.mux = mux
+        self.id = channel_id
+        self.name = name
+        self.priority = priority
+        self.credit = WINDOW
+        self.credit_changed = asyncio.Event()
+        self.incoming = asyncio.Queue()
+        self.partial = bytearray()
+        self.consumed = 0
+        self.pending = 0  # bytes queued for the shared socket, not yet written
+        self.closed = False
+
+    async def send(self, message: bytes | str):
+        if self.closed:
+            raise ConnectionClosed(None, None)
+        flags = FLAG_TEXT if isinstance(message, str) else 0
+        data = memoryview(message.encode("utf-8") if flags else message)
+        starts = range(0, len(data), MAX_FRAME) if len(data) else [0]
+
+        for start in starts:
+            piece = data[start : start + MAX_FRAME]
+            while self.credit < len(piece) and not self.closed:
+                self.credit_changed.clear()
+                await self.credit_changed.wait()
+            if self.closed:
+                raise ConnectionClosed(None, None)
+            self.credit -= len(piece)
+            more = FLAG_MORE if start + MAX_FRAME < len(data) else 0
+            written = self.mux.enqueue(self, DATA, flags | more, piece, wait=not more)
+        await written
+
+    def buffered(self) -> int:
+        return self.pending
+
+    async def recv(self) -> bytes | str:
+        message = await self.incoming.get()
+        if message is None:
+            self.incoming.put_nowait(None)  # stay closed for later calls
+            raise ConnectionClosed(None, None)
+
+        # Grant the credit back in batches rather than once per message
+        self.consumed += len(message)
+        if self.consumed >= WINDOW // 4:
+            self.mux.enqueue(self, CREDIT, 0, CREDIT_SIZE.pack(self.consumed))
+            self.consumed = 0
+        return message
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return await self.recv()
+        except ConnectionClosed:
+            raise StopAsyncIteration
+
+    def receive(self, flags: int, payload: bytes):
+        self.partial += payload
+        if flags & FLAG_MORE:
+            return
+        data = bytes(self.partial)
+        self.partial.clear()
+        self.incoming.put_nowait(data.decode("utf-8") if flags & FLAG_TEXT else data)
+
+    def grant(self, credit: int):
+        self.credit += credit
+        self.credit_changed.set()
+
+    def terminate(self):
+        """The other end or the shared socket closed the channel."""
+        if not self.closed:
+            self.closed = True
+            self.incoming.put_nowait(None)
+            self.credit_changed.set()
+        self.mux.channels.pop(self.id, None)
+
+    async def close(self):
+        if self.closed:
+            return
+        self.mux.enqueue(self, CLOSE, 0, b"")
+        self.terminate()
+
+
+class Multiplexer:
+    """Many channels over one websocket, written by a single prioritized writer.
+
+    Frames wait in one queue per priority; the writer always drains the most
+    urgent non-empty queue first and packs its small frames into one message,
+    so control and input frames overtake queued video and bulk frames.
+    """
+
+    def __init__(self, websocket):
+        self.websocket = websocket
+        self.channels: dict[int, MuxChannel] = {}
+        self.queues = [deque() for _ in (CONTROL, VIDEO, BULK)]
+        self.wakeup = asyncio.Event()
+        self.next_id = 1
+        self.tasks = []
+        self.closed = asyncio.Event()
+
+    def start(self):
+        self.tasks = [
+            asyncio.create_task(self.reader()),
+            asyncio.create_task(self.writer()),
+        ]
+
+    def open(self, name: str, priority: int = BULK) -> MuxChannel:
+        if self.closed.is_set():
+            raise ConnectionClosed(None, None)
+        while self.next_id in self.channels or self.next_id == 0:
+            self.next_id = (self.next_id + 1) & 0xFFFF
+        channel = MuxChannel(self, self.next_id, name, priority)
+        self.channels[channel.id] = channel
+        self.next_id = (self.next_id + 1) & 0xFFFF
+        self.enqueue(channel, OPEN, 0, name.encode("utf-8"))
+        return channel
+
+    def enqueue(
+        self, channel: MuxChannel, kind: int, flags: int, payload, wait: bool = False
+    ) -> asyncio.Future | None:
+        """Queue one frame; with ``wait`` returns a future set once it was written."""
+        written = asyncio.get_running_loop().create_future() if wait else None
+        if self.closed.is_set():
+            if written:
+                written.set_exception(ConnectionClosed(None, None))
+            return written
+        frame = FRAME.pack(kind, flags, channel.id, len(payload)) + payload
+        # Credit and close frames are tiny, they always travel with control
+        priority = channel.priority if kind == DATA else CONTROL
+        self.queues[priority].append((frame, channel, written))
+        channel.pending += len(frame)
+        self.wakeup.set()
+        return written
+
+    async def writer(self):
+        try:
+            while True:
+                await self.wakeup.wait()
+                self.wakeup.clear()
+                while queue := next((queue for queue in self.queues if queue), None):
+                    batch = []
+                    size = 0
+                    while queue and (not batch or size + len(queue[0][0]) <= MAX_MESSAGE):
+                        batch.append(queue.popleft())
+                        size += len(batch[-1][0])
+
+                    await self.websocket.send(b"".join(frame for frame, _, _ in batch))
+                    for frame, channel, written in batch:
+                        channel.pending -= len(frame)
+                        if written and not written.done():
+                            written.set_result(None)
+        except Exception as err:
+            print(f"Мультиплексоване з'єднання закрито: {err!r}")
+        finally:
+            self.shutdown()
+
+    async def reader(self):
+        try:
+            async for message in self.websocket:
+                if isinstance(message, str):
+                    continue
+                offset = 0
+                while offset + FRAME.size <= len(message):
+                    kind, flags, channel_id, length = FRAME.unpack_from(message, offset)
+                    offset += FRAME.size
+                    payload = message[offset : offset + length]
+                    offset += length
+
+                    channel = self.channels.get(channel_id)
+                    if channel is None:
+                        continue
+                    if kind == DATA:
+                        channel.receive(flags, payload)
+                    elif kind == CREDIT:
+                        channel.grant(CREDIT_SIZE.unpack(payload)[0])
+                    elif kind == CLOSE:
+                        channel.terminate()
+        except ConnectionClosed:
+            pass
+        finally:
+            self.shutdown()
+
+    def shutdown(self):
+        if self.closed.is_set():
+            return
+        self.closed.set()
+        for channel in list(self.channels.values()):
+            channel.terminate()
+        for queue in self.queues:
+            for _, _, written in queue:
+                if written and not written.done():
+                    written.set_exception(ConnectionClosed(None, None))
+            queue.clear()
+        for task in self.tasks:
+            task.cancel()
+
+    async def close(self):
+        self.shutdown()
+        await self.websocket.close()
+
+
+class Connector:
+    """Open the socket of a feature channel (monitor stream, download, terminal, input).
+
+    By default every channel is its own websocket on the stream endpoint, as
+    before. With ``multiplexed`` they are all channels of one shared
+    ``?channel=mux`` connection, opened on first use, so only the first channel
+    pays for the TCP/TLS handshake.
+    """
+
+    def __init__(self, stream_endpoint: str, session_id: str, multiplexed: bool = False):
+        self.stream_endpoint = stream_endpoint
+        self.session_id = session_id
+        self.multiplexed = multiplexed
+        self.mux: Multiplexer | None = None
+        self.lock = asyncio.Lock()
+
+    def uri(self, channel: str | None = None) -> str:
+        uri = f"{self.stream_endpoint}/{self.session_id}"  # WebSocket server URI
+        return f"{uri}?channel={channel}" if channel else uri
+
+    async def multiplexer(self) -> Multiplexer:
+        async with self.lock:
+            if self.mux is None or self.mux.closed.is_set():
+                websocket = await websockets.asyncio.client.connect(
+                    self.uri("mux"), max_size=None
+                )
+                self.mux = Multiplexer(websocket)
+                self.mux.start()
+            return self.mux
+
+    async def connect(
+        self, channel: str | None = None, priority: int = BULK, header: bool = False
+    ):
+        """Connect one channel; ``header`` names it with ``X-Stream-Channel``
+        (downloads) instead of ``?channel=``.
+        """
+        if self.multiplexed:
+            return (await self.multiplexer()).open(channel or "stream", priority)
+        if header:
+            return await websockets.asyncio.client.connect(
+                self.uri(), additional_headers={"X-Stream-Channel": channel}
+            )
+        return await websockets.connect(self.uri(channel))
+
+    async def close(self):
+        if self.mux:
+            await self.mux.close()
@@ -0,0 +1,138 @@
+import argparse
+import time
+from dataclasses import dataclass
+
+
+@dataclass
+class Bounds:
+    low: float
+    high: float
+
+    def clamp(self, value: float) -> float:
+        return max(self.low, min(self.high, value))
+
+
+def parse_bounds(value: str) -> Bounds:
+    """argparse type for ranges like ``20-80`` or ``0.5-1``; a single number pins the value."""
+    try:
+        low, _, high = value.partition("-")
+        bounds = Bounds(float(low), float(high or low))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"очікується діапазон МІН-МАКС: {value}")
+    if bounds.low > bounds.high:
+        raise argparse.ArgumentTypeError(f"мінімум більший за максимум: {value}")
+    return bounds
+
+
+class QualityController:
+    """Adapt JPEG quality, output scale and target FPS to how fast the link drains.
+
+    ``observe`` is fed after every send with the time ``send`` took and the bytes
+    still queued on the websocket transport. Every ``window`` seconds the
+    controller decides: a congested link (sends slower than the frame budget or a
+    growing backlog) cuts quality first, then FPS, then resolution; a link that
+    stays idle for several windows gets them back in the reverse order. Video
+    codecs have a ``bitrate`` instead of a JPEG quality: it takes the place of
+    quality, down to an eighth of the one given.
+    """
+
+    def __init__(
+        self,
+        quality: Bounds = Bounds(20, 80),
+        fps: Bounds = Bounds(5, 60),
+        scale: Bounds = Bounds(0.5, 1),
+        initial_quality: int = 30,
+        window: float = 0.5,
+        max_backlog: int = 256 * 1024,
+        bitrate: int | None = None,
+    ):
+        self.quality_bounds = quality
+        self.fps_bounds = fps
+        self.scale_bounds = scale
+        self.quality = int(quality.clamp(initial_quality))
+        self.fps = fps.high
+        self.scale = scale.high
+        self.window = window
+        self.max_backlog = max_backlog
+        self.bitrate = bitrate
+        self.bitrate_bounds = Bounds(bitrate // 8, bitrate) if bitrate else None
+
+        self.healthy_windows = 0
+        self.window_started = time.perf_counter()
+        self.sends = 0
+        self.send_time = 0.0
+        self.max_send_time = 0.0
+        self.backlog = 0
+
+    def apply(self, pipeline):
+        pipeline.quality = self.quality
+        if self.bitrate:
+            pipeline.bitrate = self.bitrate
+        pipeline.fps = self.fps
+        pipeline.scale = self.scale
+
+    def observe(self, send_time: float, backlog: int) -> bool:
+        """Record one send; returns True when the settings changed."""
+        self.sends += 1
+        self.send_time += send_time
+        self.max_send_time = max(self.max_send_time, send_time)
+        self.backlog = max(self.backlog, backlog)
+
+        now = time.perf_counter()
+        if now - self.window_started < self.window:
+            return False
+
+        changed = self.evaluate()
+        self.window_started = now
+        self.sends = 0
+        self.send_time = 0.0
+        self.max_send_time = 0.0
+        self.backlog = 0
+        return changed
+
+    def evaluate(self) -> bool:
+        budget = 1 / self.fps
+        average = self.send_time / self.sends
+
+        if self.max_send_time > budget * 2 or self.backlog > self.max_backlog:
+            self.healthy_windows = 0
+            return self.degrade()
+
+        if average < budget / 2 and self.backlog == 0:
+            self.healthy_windows += 1
+            if self.healthy_windows >= 4:
+                self.healthy_windows = 0
+                return self.improve()
+        else:
+            self.healthy_windows = 0
+        return False
+
+    def degrade(self) -> bool:
+        # Multiplicative decrease, so a collapsing link is caught up with quickly
+        previous = self.settings()
+        if self.bitrate and self.bitrate > self.bitrate_bounds.low:
+            self.bitrate = int(self.bitrate_bounds.clamp(self.bitrate * 0.7))
+        elif not self.bitrate and self.quality > self.quality_bounds.low:
+            self.quality = int(self.quality_bounds.clamp(self.quality * 0.7))
+        elif self.fps > self.fps_bounds.low:
+            self.fps = self.fps_bounds.clamp(self.fps * 0.75)
+        else:
+            self.scale = self.scale_bounds.clamp(self.scale * 0.8)
+        return previous != self.settings()
+
+    def improve(self) -> bool:
+        # Additive increase, in the reverse order of degrade()
+        previous = self.settings()
+        if self.scale < self.scale_bounds.high:
+            self.scale = self.scale_bounds.clamp(self.scale + 0.1)
+        elif self.fps < self.fps_bounds.high:
+            self.fps = self.fps_bounds.clamp(self.fps + 5)
+        elif self.bitrate:
+            step = self.bitrate_bounds.high // 10
+            self.bitrate = int(self.bitrate_bounds.clamp(self.bitrate + step))
+        else:
+            self.quality = int(self.quality_bounds.clamp(self.quality + 5))
+        return previous != self.settings()
+
+    def settings(self) -> tuple:
+        return self.quality, self.bitrate, self.fps, self.scale
@@ -0,0 +1,130 @@
+import asyncio
+import json
+import random
+from typing import Awaitable, Callable
+
+import websockets
+from rich import print
+from websockets.exceptions import ConnectionClosed, InvalidHandshake
+
+# Failures worth retrying: refused/reset connections, DNS hiccups, handshakes
+# rejected while the relay restarts and sockets dropped mid-connect
+RETRY_ERRORS = (OSError, TimeoutError, InvalidHandshake, ConnectionClosed)
+
+
+class Backoff:
+    """Exponential backoff with jitter: 0.5 s, 1 s, 2 s, ... up to ``maximum``."""
+
+    def __init__(self, initial: float = 0.5, maximum: float = 30, factor: float = 2):
+        self.initial = initial
+        self.maximum = maximum
+        self.factor = factor
+        self.delay = initial
+
+    def reset(self):
+        self.delay = self.initial
+
+    async def wait(self) -> float:
+        # Jitter keeps every channel from reconnecting in the same instant
+        delay = self.delay * random.uniform(0.8, 1.2)
+        self.delay = min(self.delay * self.factor, self.maximum)
+        await asyncio.sleep(delay)
+        return delay
+
+
+async def connect_with_backoff(
+    connect: Callable[[], Awaitable],
+    what: str,
+    backoff: Backoff | None = None,
+    attempts: int | None = None,
+):
+    """Call ``connect`` until it succeeds (or ``attempts`` ran out), sleeping with
+    backoff between attempts."""
+    backoff = backoff or Backoff()
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            return await connect()
+        except RETRY_ERRORS as err:
+            if attempts is not None and attempt >= attempts:
+                raise
+            print(f"Не вдалося під'єднати {what}: {err!r}, повтор через {backoff.delay:.1f} с")
+            await backoff.wait()
+
+
+class ControlSocket:
+    """The accept (control) socket, reconnected in place whenever it drops.
+
+    Handlers hold this object rather than a websocket, so replies of work that
+    started before a reconnect go out on the new socket. On reconnect the agent
+    asks to resume its ``session_id`` so the viewer's link keeps working; if
+    the relay hands out a new id, ``on_session`` is called with it.
+    """
+
+    def __init__(
+        self,
+        accept_endpoint: str,
+        on_session: Callable[[str], None] | None = None,
+    ):
+        self.accept_endpoint = accept_endpoint
+        self.on_session = on_session
+        self.session_id: str | None = None
+        self.websocket = None
+        self.backoff = Backoff()
+        self.lock = asyncio.Lock()
+
+    def uri(self) -> str:
+        if self.session_id is None:
+            return self.accept_endpoint
+        return f"{self.accept_endpoint}?session={self.session_id}"
+
+    async def connect(self, stale=None) -> str:
+        """(Re)connect and return the session id; ``stale`` is the socket that
+        failed, if another caller already replaced it nothing is done."""
+        async with self.lock:
+            if self.websocket is not stale:
+                return self.session_id
+
+            async def handshake():
+                websocket = await websockets.connect(self.uri())
+                try:
+                    data = json.loads(await websocket.recv())
+                except BaseException:
+                    await websocket.close()
+                    raise
+                return websocket, data["id"]
+
+            self.websocket, session_id = await connect_with_backoff(
+                handshake, "канал керування", self.backoff
+            )
+            self.backoff.reset()
+            if session_id != self.session_id:
+                self.session_id = session_id
+                if self.on_session:
+                    self.on_session(session_id)
+            return session_id
+
+    async def recv(self):
+        """Receive the next message, reconnecting as often as it takes."""
+        while True:
+            websocket = self.websocket
+            if websocket is None:
+                await self.connect()
+                continue
+            try:
+                return await websocket.recv()
+            except ConnectionClosed as err:
+                print(f"Канал керування закрито ({err}), перепідключення...")
+                await self.connect(websocket)
+
+    async def send(self, message):
+        """Send on the current socket; a reply to a socket that just dropped is lost."""
+        try:
+            await self.websocket.send(message)
+        except ConnectionClosed:
+            print("Відповідь не надіслано: канал керування перепідключається.")
+
+    async def close(self):
+        if self.websocket:
+            await self.websocket.close()
@@ -0,0 +1,146 @@
+import asyncio
+from typing import Callable
+
+from capture import CapturePipeline
+from mux import VIDEO, Connector
+from quality import Bounds, QualityController
+from reconnect import Backoff, connect_with_backoff
+from rich import print
+from sender import FrameSender
+from sources import FrameSource, MssSource
+from websockets.exceptions import ConnectionClosed
+
+
+def list_monitors(source: Callable[[], FrameSource] = MssSource) -> list[dict]:
+    """Monitors of the frame source (index 0, the union of all screens, is skipped)."""
+    with source() as screens:
+        return [
+            {"index": index, **monitor}
+            for index, monitor in enumerate(screens.monitors)
+            if index > 0
+        ]
+
+
+async def stream(
+    connector: Connector,
+    channel: str | None,
+    sender: FrameSender,
+    controller: QualityController,
+):
+    pipeline = sender.pipeline
+    controller.apply(pipeline)
+    pipeline.start()
+    backoff = Backoff()
+    websocket = None
+    try:
+        while True:
+            websocket = await connect_with_backoff(
+                lambda: connector.connect(channel, VIDEO), "відеопотік", backoff
+            )
+            sender.attach(websocket)
+            # A fresh socket may have lost frames in flight: restart from a keyframe
+            pipeline.request_keyframe()
+            try:
+                while True:
+                    # Send the newest encoded frame once the previous one has drained,
+                    # frames captured in the meantime are dropped or coalesced
+                    send_time, backlog = await sender.send(websocket)
+                    backoff.reset()
+                    if controller.observe(send_time, backlog):
+                        controller.apply(pipeline)
+            except ConnectionClosed:
+                print("Connection closed")
+    finally:
+        pipeline.stop()
+        if websocket:
+            await websocket.close()
+
+
+class ScreenStreams:
+    """One independent capture/encode pipeline and stream socket per streamed monitor.
+
+    The first monitor keeps the original stream channel, other monitors connect
+    as ``monitor-<index>``. Every pipeline has its own capture thread and
+    encoder pool, and OpenCV/NumPy release the GIL, so monitors encode in parallel.
+    """
+
+    def __init__(
+        self,
+        connector: Connector,
+        codec: str,
+        bitrate: int,
+        quality: Bounds,
+        fps: Bounds,
+        scale: Bounds,
+        source: Callable[[], FrameSource] = MssSource,
+    ):
+        self.connector = connector
+        self.source = source
+        self.codec = codec
+        self.bitrate = bitrate
+        self.bounds = (quality, fps, scale)
+        self.monitors = {monitor["index"]: monitor for monitor in list_monitors(source)}
+        self.senders: dict[int, FrameSender] = {}
+        self.tasks: dict[int, asyncio.Task] = {}
+
+    def channel(self, index: int) -> str | None:
+        return None if index == 1 else f"monitor-{index}"
+
+    def start(self, index: int):
+        if index in self.tasks or index not in self.monitors:
+            return
+        pipeline = CapturePipeline(
+            monitor_index=index, mode=self.codec, bitrate=self.bitrate, source=self.source
+        )
+        self.senders[index] = FrameSender(pipeline)
+        task = asyncio.create_task(
+            stream(
+                self.connector,
+                self.channel(index),
+                self.senders[index],
+                QualityController(
+                    *self.bounds, bitrate=pipeline.bitrate if pipeline.video else None
+                ),
+            )
+        )
+        task.add_done_callback(lambda done: self.finished(index, done))
+        self.tasks[index] = task
+
+    def finished(self, index: int, task: asyncio.Task):
+        if self.tasks.get(index) is task:
+            del self.tasks[index]
+            self.senders.pop(index, None)
+        if not task.cancelled() and task.exception():
+            print(f"Стрім монітора {index} зупинено: {task.exception()!r}")
+
+    def stop(self, index: int):
+        task = self.tasks.pop(index, None)
+        if task:
+            task.cancel()
+        self.senders.pop(index, None)
+
+    def select(self, indexes: list[int]):
+        """Stream exactly the given subset of monitors."""
+        for index in list(self.tasks):
+            if index not in indexes:
+                self.stop(index)
+        for index in indexes:
+            self.start(index)
+
+    def pipeline(self, index: int = 1) -> CapturePipeline | None:
+        sender = self.senders.get(index)
+        return sender.pipeline if sender else None
+
+    def describe(self) -> list[dict]:
+        return [
+            {**monitor, "streaming": index in self.tasks}
+            for index, monitor in self.monitors.items()
+        ]
+
+    def to_screen(self, index: int, x: float, y: float) -> tuple[float, float]:
+        """Map a point normalized to a monitor's stream into virtual-desktop pixels."""
+        monitor = self.monitors.get(index) or self.monitors[1]
+        pipeline = self.pipeline(index)
+        if pipeline:
+            x, y = pipeline.to_screen(x, y)
+        return monitor["left"] + x * monitor["width"], monitor["top"] + y * monitor["height"]
@@ -0,0 +1,299 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from fsjobs import in_fs_thread
+from rich import print
+from rich.traceback import Traceback
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    parent TEXT NOT NULL,
+    name TEXT NOT NULL,
+    type TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    link INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS files_parent ON files(parent);
+CREATE TABLE IF NOT EXISTS dirs (path TEXT PRIMARY KEY, mtime_ns INTEGER NOT NULL);
+"""
+
+# Trigram full-text index over names, so substring queries don't scan every row
+NAMES_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS names USING fts5(
+    name, content='files', content_rowid='id', tokenize='trigram case_sensitive 0'
+);
+CREATE TRIGGER IF NOT EXISTS files_ai AFTER INSERT ON files BEGIN
+    INSERT INTO names(rowid, name) VALUES (new.id, new.name);
+END;
+CREATE TRIGGER IF NOT EXISTS files_ad AFTER DELETE ON files BEGIN
+    INSERT INTO names(names, rowid, name) VALUES ('delete', old.id, old.name);
+END;
+CREATE TRIGGER IF NOT EXISTS files_au AFTER UPDATE OF name ON files BEGIN
+    INSERT INTO names(names, rowid, name) VALUES ('delete', old.id, old.name);
+    INSERT INTO names(rowid, name) VALUES (new.id, new.name);
+END;
+"""
+
+
+def index_path(base: str) -> str:
+    """On-disk location of the index for ``base``, one file per shared folder."""
+    root = os.environ.get("LOCALAPPDATA") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    digest = hashlib.sha1(os.path.realpath(base).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(root, "dimon", f"index-{digest}.sqlite3")
+
+
+def like_pattern(query: str, exact: bool = True) -> str:
+    """Turn a user query into a LIKE pattern: ``*``/``?`` wildcards, substring otherwise.
+
+    Exact patterns escape ``%`` and ``_`` for ``ESCAPE '\\'``. The trigram index
+    only serves LIKE without ESCAPE, so the loose pattern lets a literal ``%``
+    or ``_`` match any character instead; the exact one then filters the rows.
+    """
+    if exact:
+        pattern = query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    else:
+        pattern = query.replace("%", "_")
+    if "*" in query or "?" in query:
+        return pattern.replace("*", "%").replace("?", "_")
+    return f"%{pattern}%"
+
+
+class SearchIndex:
+    """Persistent index of names, sizes and mtimes under ``base`` for 'search' requests.
+
+    A background thread builds the index and then rescans periodically. Every
+    directory's mtime is stored, so a rescan only re-lists directories whose
+    entries were added, removed or renamed since the last pass; ``refresh`` asks
+    for a rescan right away (after rm/mv). Sizes of files modified in place are
+    picked up when their directory is re-listed.
+    """
+
+    def __init__(
+        self, base: str, path: str | None = None, rescan_interval: float = 60
+    ):
+        self.base = base
+        self.path = path or index_path(base)
+        self.rescan_interval = rescan_interval
+        self.local = threading.local()
+        self.running = threading.Event()
+        self.wakeup = threading.Event()
+        self.ready = threading.Event()  # set once the first full pass finished
+        self.thread = None
+        self.fts = True
+
+    def connect(self) -> sqlite3.Connection:
+        # One connection per thread; WAL lets searches read while the worker writes
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self.local.connection = connection
+        return connection
+
+    def start(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        connection = self.connect()
+        connection.executescript(SCHEMA)
+        try:
+            connection.executescript(NAMES_SCHEMA)
+        except sqlite3.OperationalError:
+            self.fts = False  # SQLite built without FTS5/trigram, fall back to scans
+        connection.commit()
+
+        self.running.set()
+        self.thread = threading.Thread(target=self.worker, name="search-index", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running.clear()
+        self.wakeup.set()
+
+    def refresh(self):
+        self.wakeup.set()
+
+    def worker(self):
+        while self.running.is_set():
+            started = time.perf_counter()
+            try:
+                self.scan()
+                if not self.ready.is_set():
+                    self.ready.set()
+                    print(
+                        f"Індекс пошуку побудовано за {time.perf_counter() - started:.1f} с"
+                    )
+            except Exception:
+                print(Traceback(show_locals=False))
+            self.wakeup.wait(self.rescan_interval)
+            self.wakeup.clear()
+
+    def scan(self):
+        connection = self.connect()
+        stack = [""]
+        pending = 0
+        while stack and self.running.is_set():
+            relative = stack.pop()
+            full = os.path.join(self.base, relative) if relative else self.base
+            try:
+                mtime_ns = os.stat(full).st_mtime_ns
+            except OSError:
+                self.remove_tree(connection, relative)
+                continue
+
+            row = connection.execute(
+                "SELECT mtime_ns FROM dirs WHERE path = ?", (relative,)
+            ).fetchone()
+            if row and row[0] == mtime_ns:
+                # Unchanged directory: only descend into the folders we know of,
+                # never through symlinks (rescan_directory doesn't follow them)
+                stack.extend(
+                    path
+                    for (path,) in connection.execute(
+                        "SELECT path FROM files "
+                        "WHERE parent = ? AND type = 'folder' AND link = 0",
+                        (relative,),
+                    )
+                )
+                continue
+
+            stack.extend(self.rescan_directory(connection, relative, full))
+            connection.execute(
+                "INSERT OR REPLACE INTO dirs (path, mtime_ns) VALUES (?, ?)",
+                (relative, mtime_ns),
+            )
+            pending += 1
+            if pending >= 200:
+                connection.commit()
+                pending = 0
+        connection.commit()
+
+    def rescan_directory(
+        self, connection: sqlite3.Connection, relative: str, full: str
+    ) -> list[str]:
+        """Sync the rows of one directory with the disk; returns its subfolders to visit."""
+        existing = {
+            name: (kind, size, mtime, link)
+            for name, kind, size, mtime, link in connection.execute(
+                "SELECT name, type, size, mtime, link FROM files WHERE parent = ?",
+                (relative,),
+            )
+        }
+        subfolders = []
+        try:
+            with os.scandir(full) as entries:
+                for entry in entries:
+                    try:
+                        stat_info = entry.stat(follow_symlinks=False)
+                        is_dir = entry.is_dir()
+                        is_link = entry.is_symlink()
+                    except OSError:
+                        continue
+                    path = f"{relative}/{entry.name}" if relative else entry.name
+                    kind = "folder" if is_dir else "file"
+                    size = 0 if is_dir else stat_info.st_size
+                    row = (kind, size, stat_info.st_mtime, int(is_link))
+
+                    if existing.pop(entry.name, None) != row:
+                        connection.execute(
+                            "INSERT INTO files (path, parent, name, type, size, mtime, link) "
+                            "VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT(path) DO UPDATE SET "
+                            "type = excluded.type, size = excluded.size, "
+                            "mtime = excluded.mtime, link = excluded.link",
+                            (path, relative, entry.name, *row),
+                        )
+                        if is_link:
+                            # A folder replaced by a link: its old contents are gone
+                            self.remove_children(connection, path)
+                    # Symlinked folders are listed but not followed, to avoid cycles
+                    if is_dir and not is_link:
+                        subfolders.append(path)
+        except OSError:
+            pass
+
+        for name in existing:
+            self.remove_tree(connection, f"{relative}/{name}" if relative else name)
+        return subfolders
+
+    def remove_tree(self, connection: sqlite3.Connection, relative: str):
+        for table in ("files", "dirs"):
+            connection.execute(f"DELETE FROM {table} WHERE path = ?", (relative,))
+        self.remove_children(connection, relative)
+
+    def remove_children(self, connection: sqlite3.Connection, relative: str):
+        prefix = f"{relative}/"
+        for table in ("files", "dirs"):
+            connection.execute(
+                f"DELETE FROM {table} WHERE substr(path, 1, ?) = ?",
+                (len(prefix), prefix),
+            )
+
+    def search(self, query: str, limit: int = 200, offset: int = 0) -> list[dict]:
+        """Case-insensitive name search: substring, or ``*``/``?`` wildcards.
+
+        With the trigram index, pages follow the index order and only the page
+        itself is sorted by path, so a query never sorts every match.
+        """
+        pattern = like_pattern(query)
+        if self.fts:
+            exact = "%" in query or "_" in query
+            sql = (
+                "SELECT path, name, type, size, mtime FROM files WHERE id IN ("
+                "SELECT names.rowid FROM names JOIN files ON files.id = names.rowid "
+                "WHERE names.name LIKE ?"
+                + (" AND files.name LIKE ? ESCAPE '\\'" if exact else "")
+                + " ORDER BY names.rowid LIMIT ? OFFSET ?) ORDER BY path"
+            )
+            params = (like_pattern(query, exact=False),)
+            params += (pattern, limit, offset) if exact else (limit, offset)
+        else:
+            sql = (
+                "SELECT path, name, type, size, mtime FROM files "
+                "WHERE name LIKE ? ESCAPE '\\' ORDER BY path LIMIT ? OFFSET ?"
+            )
+            params = (pattern, limit, offset)
+        return [
+            {
+                "type": kind,
+                "name": name,
+                "path": f"root/{path}",
+                **({"bytes": size} if kind == "file" else {}),
+                "modifiedAt": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(mtime)),
+            }
+            for path, name, kind, size, mtime in self.connect().execute(sql, params)
+        ]
+
+
+async def handle_search_request(ws, message, index: SearchIndex):
+    """Handle 'search' request: ``query`` with optional ``limit``/``offset``."""
+    request_id = message["requestId"]
+    try:
+        results = await in_fs_thread(
+            index.search,
+            str(message["query"]),
+            min(max(int(message.get("limit", 200)), 1), 5000),
+            max(int(message.get("offset", 0)), 0),
+        )
+    except Exception as err:
+        print(err)
+        results = []
+
+    await ws.send(
+        json.dumps(
+            {
+                "requestId": request_id,
+                "event": "search",
+                "query": message["query"],
+                "results": results,
+                "ready": index.ready.is_set(),
+            }
+        )
+    )
@@ -0,0 +1,92 @@
+import time
+
+import websockets
+
+from capture import CapturePipeline
+from metrics import frame_bytes, frame_stage_seconds, frames_dropped, frames_sent
+
+
+class StreamStats:
+    """Per-second counters for the frame stream; ``last`` holds the previous full second."""
+
+    def __init__(self):
+        self.window_started = time.perf_counter()
+        self.sent = 0
+        self.dropped = 0
+        self.bytes = 0
+        self.ages = []
+        self.last = self.snapshot(1.0)
+
+    def record(self, size: int, age: float, dropped: int):
+        self.sent += 1
+        self.bytes += size
+        self.dropped += dropped
+        self.ages.append(age)
+
+        now = time.perf_counter()
+        elapsed = now - self.window_started
+        if elapsed >= 1:
+            self.last = self.snapshot(elapsed)
+            self.window_started = now
+            self.sent = 0
+            self.dropped = 0
+            self.bytes = 0
+            self.ages = []
+
+    def snapshot(self, elapsed: float) -> dict:
+        ages = sorted(self.ages)
+        return {
+            "fps": round(self.sent / elapsed, 1),
+            "droppedPerSecond": round(self.dropped / elapsed, 1),
+            "bytesPerSecond": round(self.bytes / elapsed),
+            "frameAgeMs": {
+                "mean": round(sum(ages) / len(ages) * 1000, 1) if ages else 0,
+                "max": round(ages[-1] * 1000, 1) if ages else 0,
+            },
+        }
+
+
+class FrameSender:
+    """Send frames so that at most one is ever queued on the websocket transport.
+
+    The transport's write-buffer limits are lowered so ``send`` only returns once
+    the previous frame has been flushed to the socket. Meanwhile the pipeline's
+    latest-frame-wins mailbox keeps replacing unsent frames, so the next frame
+    taken is always the newest one. Tile and video updates are coalesced
+    instead, up to the size of a keyframe and never past the pipeline's
+    ``max_pending`` bytes; a bigger backlog is replaced by a keyframe, so what
+    is in flight stays one frame's worth in every mode.
+    """
+
+    def __init__(self, pipeline: CapturePipeline, max_outstanding: int = 16 * 1024):
+        self.pipeline = pipeline
+        self.max_outstanding = max_outstanding
+        self.stats = StreamStats()
+        self.dropped_seen = 0
+
+    def attach(self, websocket: websockets.WebSocketClientProtocol):
+        # Pause writing above max_outstanding and resume only once fully drained;
+        # a multiplexed channel's send already waits until its frame is written
+        if transport := getattr(websocket, "transport", None):
+            transport.set_write_buffer_limits(high=self.max_outstanding, low=0)
+
+    async def send(
+        self, websocket: websockets.WebSocketClientProtocol
+    ) -> tuple[float, int]:
+        """Send the newest frame; returns the send duration and the remaining backlog."""
+        img_bytes, captured_at = await self.pipeline.get()
+
+        started = time.perf_counter()
+        await websocket.send(img_bytes)
+        finished = time.perf_counter()
+
+        dropped = self.pipeline.frames.dropped
+        self.stats.record(len(img_bytes), finished - captured_at, dropped - self.dropped_seen)
+        frame_stage_seconds.observe(finished - started, "send")
+        frames_sent.inc()
+        frame_bytes.inc(len(img_bytes))
+        frames_dropped.inc(dropped - self.dropped_seen)
+        self.dropped_seen = dropped
+        transport = getattr(websocket, "transport", None)
+        backlog = transport.get_write_buffer_size() if transport else websocket.buffered()
+        return finished - started, backlog
@@ -0,0 +1,280 @@
+import argparse
+import os
+import struct
+import time
+from abc import ABC, abstractmethod
+from functools import partial
+from typing import Callable
+
+import cv2
+import mss
+import numpy as np
+from rich import print
+
+# A recorded capture: header, then ``frames`` raw BGRA frames back to back,
+# read through a memory map so replay never copies the whole file into memory
+#   <4sHHIIIf  magic, version, reserved, width, height, frames, fps
+RECORDING = struct.Struct("<4sHHIIIf")
+MAGIC = b"DIMR"
+VERSION = 1
+
+PATTERNS = ("motion", "text", "static")
+
+
+class FrameSource(ABC):
+    """Where the capture pipeline takes its frames from, mss by default.
+
+    ``monitors`` follows mss: index 0 is the union of all screens, then one
+    dict (left, top, width, height) per screen. ``grab`` returns a BGRA
+    ``uint8`` array of the given rectangle of the virtual desktop. Every
+    capture thread opens its own source.
+    """
+
+    monitors: list[dict]
+
+    @abstractmethod
+    def grab(self, monitor: dict) -> np.ndarray: ...
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class MssSource(FrameSource):
+    """The real screens."""
+
+    def __init__(self):
+        self.sct = mss.mss()
+        self.monitors = self.sct.monitors
+
+    def grab(self, monitor: dict) -> np.ndarray:
+        return np.array(self.sct.grab(monitor))
+
+    def close(self):
+        self.sct.close()
+
+
+def single_monitor(width: int, height: int) -> list[dict]:
+    monitor = {"left": 0, "top": 0, "width": width, "height": height}
+    return [monitor, dict(monitor)]
+
+
+def crop(frame: np.ndarray, monitor: dict) -> np.ndarray:
+    top, left = monitor["top"], monitor["left"]
+    return frame[top : top + monitor["height"], left : left + monitor["width"]]
+
+
+class SyntheticSource(FrameSource):
+    """A generated desktop, identical on every run, for headless benchmarks.
+
+    * ``static``: windows on a wallpaper that never change, so tiles and
+      inter-frame codecs have (almost) nothing to send;
+    * ``text``: a terminal window scrolling lines of text, like logs or code;
+    * ``motion``: the whole screen panning over a detailed scene, like video.
+
+    Time advances one step per grab, not with the clock, so a run depends only
+    on the number of frames taken.
+    """
+
+    def __init__(self, pattern: str = "motion", width: int = 1920, height: int = 1080):
+        self.pattern = pattern
+        self.monitors = single_monitor(width, height)
+        self.width = width
+        self.height = height
+        self.step = 0
+        self.desktop = self.draw_desktop()
+        if pattern == "text":
+            self.lines = self.draw_lines()
+        elif pattern == "motion":
+            self.scene = self.draw_scene()
+
+    def draw_desktop(self) -> np.ndarray:
+        rows = np.linspace(60, 160, self.height, dtype=np.uint8)[:, None]
+        desktop = np.zeros((self.height, self.width, 4), np.uint8)
+        desktop[..., 0] = rows
+        desktop[..., 1] = rows // 2
+        desktop[..., 2] = 40
+        desktop[..., 3] = 255
+        for index in range(3):
+            x = self.width // 10 + index * self.width // 5
+            y = self.height // 8 + index * self.height // 10
+            w, h = self.width // 3, self.height // 3
+            desktop[y : y + h, x : x + w] = (235, 235, 235, 255)
+            desktop[y : y + 28, x : x + w] = (120, 80, 40, 255)
+            cv2.putText(
+                desktop, f"Window {index + 1}", (x + 8, y + 20),
+                cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255, 255), 1,
+            )  # fmt: skip
+        desktop.setflags(write=False)
+        return desktop
+
+    def draw_lines(self) -> np.ndarray:
+        """A strip of text taller than the screen, scrolled through in a loop."""
+        line_height = 18
+        count = max(200, self.height // line_height * 2)
+        lines = np.full((count * line_height, self.width, 4), (30, 30, 30, 255), np.uint8)
+        random = np.random.default_rng(0)
+        words = ["def", "return", "self", "frame", "await", "async", "import", "numpy"]
+        for line in range(count):
+            text = " ".join(random.choice(words, size=random.integers(3, 14)))
+            cv2.putText(
+                lines, f"{line:5}  {text}", (8, line * line_height + 14),
+                cv2.FONT_HERSHEY_PLAIN, 1.0, (200, 220, 200, 255), 1,
+            )  # fmt: skip
+        return lines
+
+    def draw_scene(self) -> np.ndarray:
+        """A scene twice the screen size with gradients, shapes and grain to pan over."""
+        height, width = self.height * 2, self.width * 2
+        x = np.arange(width, dtype=np.float32)
+        y = np.arange(height, dtype=np.float32)[:, None]
+        scene = np.zeros((height, width, 4), np.uint8)
+        scene[..., 0] = (127 + 127 * np.sin(x / 97)).astype(np.uint8)
+        scene[..., 1] = (127 + 127 * np.sin(y / 71)).astype(np.uint8)
+        scene[..., 2] = (127 + 127 * np.sin((x + y) / 131)).astype(np.uint8)
+        scene[..., 3] = 255
+        random = np.random.default_rng(0)
+        for _ in range(200):
+            center = (int(random.integers(width)), int(random.integers(height)))
+            color = tuple(int(value) for value in random.integers(0, 256, 3)) + (255,)
+            cv2.circle(scene, center, int(random.integers(10, 120)), color, -1)
+        # Fine grain, so the scene compresses like a photo and not like flat shapes
+        grain = random.integers(0, 24, (height, width), dtype=np.uint8)
+        scene[..., 3] = 0
+        scene = cv2.add(scene, cv2.merge([grain, grain, grain, grain]))
+        scene[..., 3] = 255
+        return scene
+
+    def grab(self, monitor: dict) -> np.ndarray:
+        step = self.step
+        self.step += 1
+        if self.pattern == "static":
+            frame = self.desktop
+        elif self.pattern == "text":
+            frame = self.desktop.copy()
+            top, left = self.height // 10, self.width // 20
+            height, width = self.height * 4 // 5, self.width * 9 // 10
+            rows = (np.arange(height) + step * 4) % len(self.lines)
+            frame[top : top + height, left : left + width] = self.lines[rows, :width]
+        else:
+            # Pan along an ellipse so the motion keeps changing direction
+            x = int((1 + np.cos(step / 90)) / 2 * (self.width - 1))
+            y = int((1 + np.sin(step / 60)) / 2 * (self.height - 1))
+            frame = self.scene[y : y + self.height, x : x + self.width]
+        return np.ascontiguousarray(crop(frame, monitor))
+
+
+class ReplaySource(FrameSource):
+    """Frames of a recording made with ``python sources.py``, replayed in a loop."""
+
+    def __init__(self, path: str):
+        width, height, count, self.fps = read_header(path)
+        self.monitors = single_monitor(width, height)
+        self.frames = np.memmap(
+            path, np.uint8, "r", offset=RECORDING.size, shape=(count, height, width, 4)
+        )
+        self.step = 0
+
+    def grab(self, monitor: dict) -> np.ndarray:
+        frame = self.frames[self.step % len(self.frames)]
+        self.step += 1
+        return np.ascontiguousarray(crop(frame, monitor))
+
+    def close(self):
+        self.frames = None  # unmapped once the last grabbed view is gone
+
+
+def read_header(path: str) -> tuple[int, int, int, float]:
+    with open(path, "rb") as file:
+        header = file.read(RECORDING.size)
+    if len(header) < RECORDING.size:
+        raise ValueError(f"{path}: не запис захоплення")
+    magic, version, _, width, height, count, fps = RECORDING.unpack(header)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"{path}: не запис захоплення або невідома версія {version}")
+    if count == 0:
+        raise ValueError(f"{path}: запис порожній")
+    return width, height, count, fps
+
+
+def record(
+    open_source: Callable[[], FrameSource],
+    path: str,
+    frames: int,
+    monitor_index: int = 1,
+    fps: float = 30,
+):
+    """Capture ``frames`` frames of a monitor at ``fps`` into a recording file."""
+    with open_source() as source, open(path, "wb") as file:
+        monitor = source.monitors[monitor_index]
+        width, height = monitor["width"], monitor["height"]
+        file.write(RECORDING.pack(MAGIC, VERSION, 0, width, height, 0, fps))
+        recorded = 0
+        for _ in range(frames):
+            started = time.perf_counter()
+            frame = source.grab(monitor)
+            if frame.shape != (height, width, 4):
+                break  # the screen was resized, the recording keeps one size
+            file.write(np.ascontiguousarray(frame, np.uint8).data)
+            recorded += 1
+            delay = 1 / fps - (time.perf_counter() - started)
+            if delay > 0:
+                time.sleep(delay)
+        file.seek(0)
+        file.write(RECORDING.pack(MAGIC, VERSION, 0, width, height, recorded, fps))
+    print(f"Записано {recorded} кадрів {width}x{height} у {path}")
+
+
+def parse_source(value: str) -> Callable[[], FrameSource]:
+    """argparse type for ``mss``, ``synthetic[:pattern[:WIDTHxHEIGHT]]`` or
+    ``replay:PATH``; returns a function opening a new source."""
+    kind, _, rest = value.partition(":")
+    if kind == "mss" and not rest:
+        return MssSource
+    if kind == "synthetic":
+        pattern, _, size = rest.partition(":")
+        pattern = pattern or "motion"
+        if pattern not in PATTERNS:
+            raise argparse.ArgumentTypeError(
+                f"невідомий шаблон {pattern}, очікується один з: {', '.join(PATTERNS)}"
+            )
+        try:
+            width, height = (int(part) for part in (size or "1920x1080").split("x"))
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"очікується розмір ШИРИНАxВИСОТА: {size}")
+        if width < 64 or height < 64:
+            raise argparse.ArgumentTypeError(f"замалий розмір: {size}")
+        return partial(SyntheticSource, pattern, width, height)
+    if kind == "replay" and rest:
+        try:
+            read_header(rest)
+        except (OSError, ValueError) as err:
+            raise argparse.ArgumentTypeError(str(err))
+        return partial(ReplaySource, rest)
+    raise argparse.ArgumentTypeError(
+        f"очікується mss, synthetic[:шаблон[:ШxВ]] або replay:ШЛЯХ: {value}"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Запис захоплення екрана для --source replay:")
+    parser.add_argument("output", help="Файл запису")
+    parser.add_argument("--frames", type=int, default=300, help="Кількість кадрів (дефолт: 300)")
+    parser.add_argument("--fps", type=float, default=30, help="Частота кадрів (дефолт: 30)")
+    parser.add_argument("--monitor", type=int, default=1, help="Номер монітора (дефолт: 1)")
+    parser.add_argument(
+        "--source",
+        type=parse_source,
+        default="mss",
+        help="Що записувати: mss або synthetic[:шаблон[:ШxВ]] (дефолт: mss)",
+    )
+
+    args = parser.parse_args()
+    if os.path.exists(args.output):
+        parser.error(f"{args.output} вже існує")
+    record(args.source, args.output, args.frames, args.monitor, args.fps)
@@ -9,10 +9,25 @@ else:
 import asyncio
 import shutil
 import os
+import time
+from collections import deque
+from metrics import terminal_bytes
 from websockets.exceptions import ConnectionClosed
 from rich import print
 from rich.traceback import Traceback
 
+READ_SIZE = 64 * 1024
+# Output is gathered for up to COALESCE_DELAY or COALESCE_BYTES before it is
+# sent, so a flood like `cat bigfile` becomes a few large frames
+COALESCE_DELAY = 0.005
+COALESCE_BYTES = 64 * 1024
+# Stop reading the PTY while this much output waits for the socket
+MAX_PENDING = 1024 * 1024
+SCROLLBACK_BYTES = 256 * 1024
+
+# Anything written before these is wiped from the screen anyway
+CLEAR_SCREEN = (b"\033[2J", b"\033c")
+
 
 def select_shell():
     """Select the appropriate shell based on the operating system."""
@@ -25,21 +40,70 @@ def select_shell():
         return "bash"
 
 
+class Scrollback:
+    """Ring buffer with the last ``limit`` bytes of a terminal's output.
+
+    Output before the latest clear-screen is dropped as it arrives, so a
+    reattaching viewer replays what is on the screen (plus history up to the
+    limit) rather than everything the shell ever printed.
+    """
+
+    def __init__(self, limit: int = SCROLLBACK_BYTES):
+        self.limit = limit
+        self.chunks: deque[bytes] = deque()
+        self.size = 0
+        self.trimmed = False
+
+    def append(self, data: bytes):
+        cut = max(data.rfind(sequence) for sequence in CLEAR_SCREEN)
+        if cut >= 0:
+            self.chunks.clear()
+            self.size = 0
+            self.trimmed = False
+            data = data[cut:]
+
+        self.chunks.append(data)
+        self.size += len(data)
+        while self.size - len(self.chunks[0]) >= self.limit:
+            self.size -= len(self.chunks.popleft())
+            self.trimmed = True
+
+    def snapshot(self) -> bytes:
+        """The retained output as one chunk, which also compacts the buffer."""
+        data = b"".join(self.chunks)
+        if self.size > self.limit:
+            data = data[-self.limit :]
+            self.trimmed = True
+        if self.trimmed:
+            # Start on a line boundary, not in the middle of an escape sequence
+            data = data[data.find(b"\n") + 1 :]
+            self.trimmed = False
+        self.chunks = deque([data])
+        self.size = len(data)
+        return data
+
+
 class TerminalSession:
     def __init__(
         self,
-        ws: websockets.WebSocketClientProtocol,
+        ws: websockets.WebSocketClientProtocol | None,
         base_dir: str,
         shell: str | None = None,
+        name: str = "default",
     ):
         self.ws = ws
         self.base_dir = base_dir
         self.shell = shell
+        self.name = name
         self.process = None
         self.read_task = None
         self.write_task = None
         self.active = False
         self.master_fd = None  # Add this attribute to store master_fd
+        self.scrollback = Scrollback()
+        self.send_lock = asyncio.Lock()  # keeps replays and live output in order
+        self.write_lock = asyncio.Lock()  # one pending input write per PTY
+        self.detached_at = None if ws else time.monotonic()
 
     async def start(self, columns: int, lines: int):
         """Start the shell subprocess within a PTY and initiate data forwarding."""
@@ -52,7 +116,7 @@ class TerminalSession:
             self.process.spawn(shell if not self.shell else self.shell, cwd=self.base_dir)  # noqa
             self.active = True
             self.read_task = asyncio.create_task(self.read_from_shell_windows())
-            self.write_task = asyncio.create_task(self.write_to_shell_windows())
+            self.write_task = asyncio.create_task(self.write_to_shell_windows(self.ws))
         else:
 
             def preexec():
@@ -87,6 +151,9 @@ class TerminalSession:
                     stderr=slave_fd,
                     preexec_fn=preexec,
                 )
+            # The child has its own copy; closing ours lets reads fail with EIO
+            # once the shell exits instead of blocking forever
+            os.close(slave_fd)
             self.active = True
 
             # Start reading and writing
@@ -94,7 +161,7 @@ class TerminalSession:
                 self.read_from_shell_unix(self.master_fd)
             )
             self.write_task = asyncio.create_task(
-                self.write_to_shell_unix(self.master_fd)
+                self.write_to_shell_unix(self.master_fd, self.ws)
             )
 
             await self.set_terminal_size(columns, lines)
@@ -102,8 +169,45 @@ class TerminalSession:
         await self.set_title(shell if not self.shell else self.shell)
 
     async def set_title(self, title: str):
-        await self.ws.send(b"\033[2J\x1b[A\x1b[A")
-        await self.ws.send(f"\033]0;{title}\007".encode("utf-8", errors="ignore"))
+        await self.output(b"\033[2J\x1b[A\x1b[A")
+        await self.output(f"\033]0;{title}\007".encode("utf-8", errors="ignore"))
+
+    async def output(self, data: bytes):
+        """Record shell output in the scrollback and forward it to the viewer, if any."""
+        async with self.send_lock:
+            self.scrollback.append(data)
+            terminal_bytes.inc(len(data), "output")
+            if self.ws is None:
+                return
+            try:
+                await self.ws.send(data)
+            except ConnectionClosed:
+                self.detach(self.ws)
+
+    async def attach(self, ws: websockets.WebSocketClientProtocol):
+        """Hand the running shell to a new viewer socket and replay the scrollback."""
+        if self.write_task:
+            self.write_task.cancel()
+        async with self.send_lock:
+            previous, self.ws = self.ws, ws
+            self.detached_at = None
+            await ws.send(b"\033[2J\033[H" + self.scrollback.snapshot())
+        if platform.system() == "Windows":
+            self.write_task = asyncio.create_task(self.write_to_shell_windows(ws))
+        else:
+            self.write_task = asyncio.create_task(
+                self.write_to_shell_unix(self.master_fd, ws)
+            )
+        if previous and previous is not ws:
+            await previous.close()
+
+    def detach(self, ws: websockets.WebSocketClientProtocol):
+        """The viewer went away: keep the shell running and buffering output."""
+        if self.ws is ws:
+            self.ws = None
+            self.detached_at = time.monotonic()
+            if self.active:
+                print(f"Термінал {self.name} від'єднано, сесія працює далі.")
 
     async def set_terminal_size(self, columns: int, lines: int):
         """Set the terminal size of the subprocess."""
@@ -127,38 +231,110 @@ class TerminalSession:
                 print(f"Error setting terminal size: {e}")
 
     async def read_from_shell_unix(self, master_fd: int):
-        """Read output from the shell PTY on Unix-like systems and send to WebSocket."""
+        """Read output from the shell PTY on Unix-like systems and send to WebSocket.
+
+        The non-blocking master fd is watched by the event loop itself, every
+        wakeup drains everything available and the pending output is sent in
+        coalesced frames.
+        """
+        loop = asyncio.get_running_loop()
+        pending = bytearray()
+        available = asyncio.Event()
+        eof = False
+
+        def on_readable():
+            nonlocal eof
+            try:
+                while len(pending) < MAX_PENDING:
+                    data = os.read(master_fd, READ_SIZE)
+                    if not data:
+                        eof = True
+                        break
+                    pending.extend(data)
+            except BlockingIOError:
+                pass
+            except OSError:
+                eof = True  # EIO: the shell exited and the PTY was hung up
+            if eof or len(pending) >= MAX_PENDING:
+                loop.remove_reader(master_fd)
+            available.set()
+
+        os.set_blocking(master_fd, False)
+        loop.add_reader(master_fd, on_readable)
         try:
-            loop = asyncio.get_running_loop()
             while True:
-                # Read asynchronously from the PTY
-                data = await loop.run_in_executor(None, os.read, master_fd, 1024)
-                if not data:
+                await available.wait()
+                if not eof and len(pending) < COALESCE_BYTES:
+                    await asyncio.sleep(COALESCE_DELAY)
+                available.clear()
+                if pending:
+                    data = bytes(pending)
+                    pending.clear()
+                    if not eof:
+                        loop.add_reader(master_fd, on_readable)  # resume if paused
+                    await self.output(data)
+                if eof and not pending:
                     break
-                await self.ws.send(data)
-                # print(data.decode("utf-8", errors="ignore"), end="")
         except Exception as e:
             assert e
             print(Traceback(show_locals=True))
         finally:
+            loop.remove_reader(master_fd)
             await self.close()
 
-    async def write_to_shell_unix(self, master_fd: int):
+    async def write_input(self, master_fd: int, data: bytes):
+        """Write all of ``data`` to the PTY, waiting while the shell isn't reading.
+
+        The master fd is non-blocking (see ``read_from_shell_unix``), so a large
+        paste may only partly fit; the rest is flushed by the event loop as the
+        PTY drains. Not reading the socket meanwhile pushes back on the viewer.
+        """
+        loop = asyncio.get_running_loop()
+        async with self.write_lock:
+            written = loop.create_future()
+            remaining = memoryview(data)
+
+            def on_writable():
+                nonlocal remaining
+                try:
+                    while remaining:
+                        remaining = remaining[os.write(master_fd, remaining) :]
+                except BlockingIOError:
+                    return  # wait for the next writable event
+                except OSError as err:
+                    if not written.done():
+                        written.set_exception(err)
+                    return
+                if not written.done():
+                    written.set_result(None)
+
+            on_writable()
+            if not written.done():
+                loop.add_writer(master_fd, on_writable)
+            try:
+                await written
+            finally:
+                loop.remove_writer(master_fd)
+
+    async def write_to_shell_unix(
+        self, master_fd: int, ws: websockets.WebSocketClientProtocol
+    ):
         """Receive data from the WebSocket and write to the shell PTY on Unix-like systems."""
         try:
-            async for message in self.ws:
+            async for message in ws:
                 if isinstance(message, bytes):
                     data = message
                 else:
                     data = message.encode("utf-8", errors="ignore")
-                os.write(master_fd, data)
+                await self.write_input(master_fd, data)
+                terminal_bytes.inc(len(data), "input")
         except ConnectionClosed:
             print("WebSocket connection closed.")
         except Exception as e:
             assert e
             print(Traceback(show_locals=True))
         finally:
-            await self.close()
+            self.detach(ws)
 
     async def read_from_shell_windows(self):
         """Read output from the shell PTY on Windows and send to WebSocket."""
@@ -168,29 +344,30 @@ class TerminalSession:
                 if not data:
                     await asyncio.sleep(0.1)
                     continue
-                await self.ws.send(data.encode("utf-8", errors="ignore"))
+                await self.output(data.encode("utf-8", errors="ignore"))
         except Exception as e:
             assert e
             print(Traceback(show_locals=True))
         finally:
             await self.close()
 
-    async def write_to_shell_windows(self):
+    async def write_to_shell_windows(self, ws: websockets.WebSocketClientProtocol):
         """Receive data from the WebSocket and write to the shell PTY on Windows."""
         try:
-            async for message in self.ws:
+            async for message in ws:
                 if isinstance(message, bytes):
                     data = message.decode("utf-8", errors="ignore")
                 else:
                     data = message
                 self.process.write(data)  # noqa
+                terminal_bytes.inc(len(data), "input")
         except ConnectionClosed:
             print("WebSocket connection closed.")
         except Exception as e:
             assert e
             print(Traceback(show_locals=True))
         finally:
-            await self.close()
+            self.detach(ws)
 
     async def close(self):
         """Terminate the shell subprocess and cancel tasks."""
@@ -201,6 +378,8 @@ class TerminalSession:
                     self.process.terminate()
                 else:
                     del self.process
+            except ProcessLookupError:
+                pass  # the shell has already exited
             except Exception as e:
                 assert e
                 print(Traceback(show_locals=True))
@@ -210,3 +389,91 @@ class TerminalSession:
             if self.write_task:
                 self.write_task.cancel()
             print("Terminal session closed.")
+
+
+class TerminalSessions:
+    """Named terminal sessions that outlive the viewer's terminal socket.
+
+    Opening a name that is still running reattaches to it and replays its
+    scrollback; sessions left detached for ``idle_timeout`` seconds are closed
+    the next time one is opened.
+    """
+
+    def __init__(
+        self,
+        base_dir: str,
+        shell: str | None = None,
+        max_sessions: int = 8,
+        idle_timeout: float = 30 * 60,
+    ):
+        self.base_dir = base_dir
+        self.shell = shell
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.sessions: dict[str, TerminalSession] = {}
+
+    def get(self, name: str) -> TerminalSession | None:
+        session = self.sessions.get(name)
+        if session and not session.active:
+            del self.sessions[name]
+            return None
+        return session
+
+    async def open(
+        self,
+        name: str,
+        ws: websockets.WebSocketClientProtocol,
+        columns: int,
+        lines: int,
+    ) -> TerminalSession:
+        await self.reap()
+        if session := self.get(name):
+            await session.set_terminal_size(columns, lines)
+            await session.attach(ws)
+            print(f"Термінал {name} під'єднано знову.")
+            return session
+
+        if len(self.sessions) >= self.max_sessions:
+            # Make room by closing the session that was detached the longest
+            oldest = min(
+                (s for s in self.sessions.values() if s.detached_at is not None),
+                key=lambda s: s.detached_at,
+                default=None,
+            )
+            if oldest is None:
+                raise RuntimeError(f"Забагато відкритих терміналів ({self.max_sessions})")
+            await self.close(oldest.name)
+
+        session = TerminalSession(ws, self.base_dir, self.shell, name)
+        self.sessions[name] = session
+        await session.start(columns, lines)
+        return session
+
+    async def reap(self):
+        now = time.monotonic()
+        for name, session in list(self.sessions.items()):
+            if not session.active or (
+                session.detached_at is not None
+                and now - session.detached_at > self.idle_timeout
+            ):
+                await self.close(name)
+
+    async def resize(self, name: str, columns: int, lines: int):
+        if session := self.get(name):
+            await session.set_terminal_size(columns, lines)
+
+    async def close(self, name: str):
+        session = self.sessions.pop(name, None)
+        if session and session.active:
+            await session.close()
+
+    async def close_all(self):
+        for name in list(self.sessions):
+            await self.close(name)
+
+    def describe(self) -> list[dict]:
+        return [
+            {"name": name, "attached": session.ws is not None}
+            for name, session in self.sessions.items()
+            if session.active
+        ]
@@ -0,0 +1,101 @@
+import struct
+from dataclasses import dataclass, field
+
+import numpy as np
+
+TILE_SIZE = 64
+
+# Message layout (little-endian):
+#   header: kind (u8, always 1), flags (u8), frame width (u16), frame height (u16), tile count (u16)
+#   per tile: x (u16), y (u16), width (u16), height (u16), JPEG length (u32)
+#   followed by the JPEG payloads in the same order as the tile records
+HEADER = struct.Struct("<BBHHH")
+TILE = struct.Struct("<HHHHI")
+
+KIND_TILES = 1
+FLAG_KEYFRAME = 0x01
+
+
+@dataclass
+class TileUpdate:
+    width: int
+    height: int
+    keyframe: bool
+    tiles: list[tuple[int, int, int, int, bytes]] = field(default_factory=list)
+
+    def merge(self, newer: "TileUpdate") -> "TileUpdate":
+        """Coalesce an unsent update with a newer one (tiles are painted in order).
+
+        Older tiles that a newer tile paints over completely are dropped, so a
+        region that keeps changing is sent once, not once per frame.
+        """
+        if newer.keyframe or (newer.width, newer.height) != (self.width, self.height):
+            return newer
+        # Tiles share the TILE_SIZE grid, so a covering tile is on the same row
+        rows: dict[int, list[tuple[int, int, int]]] = {}
+        for x, y, w, h, _ in newer.tiles:
+            rows.setdefault(y, []).append((x, x + w, y + h))
+        kept = [
+            tile
+            for tile in self.tiles
+            if not any(
+                left <= tile[0] and tile[0] + tile[2] <= right and tile[1] + tile[3] <= bottom
+                for left, right, bottom in rows.get(tile[1], ())
+            )
+        ]
+        return TileUpdate(self.width, self.height, self.keyframe, kept + newer.tiles)
+
+    def __len__(self) -> int:
+        return len(self.tiles)
+
+    def size(self) -> int:
+        """Bytes ``pack`` produces."""
+        return HEADER.size + sum(TILE.size + len(jpeg) for *_, jpeg in self.tiles)
+
+    def pack(self) -> bytes:
+        header = HEADER.pack(
+            KIND_TILES,
+            FLAG_KEYFRAME if self.keyframe else 0,
+            self.width,
+            self.height,
+            len(self.tiles),
+        )
+        records = b"".join(
+            TILE.pack(x, y, w, h, len(jpeg)) for x, y, w, h, jpeg in self.tiles
+        )
+        return b"".join([header, records, *(jpeg for *_, jpeg in self.tiles)])
+
+
+def dirty_rects(
+    prev: np.ndarray | None, frame: np.ndarray, tile: int = TILE_SIZE
+) -> list[tuple[int, int, int, int]]:
+    """Return rectangles (x, y, w, h) covering the tiles that differ between two BGRA frames.
+
+    Horizontally adjacent dirty tiles are merged into one rectangle, so a keyframe
+    (``prev`` is None) becomes one full-width band per tile row.
+    """
+    height, width = frame.shape[:2]
+    if prev is None or prev.shape != frame.shape:
+        changed = np.ones(
+            ((height + tile - 1) // tile, (width + tile - 1) // tile), dtype=bool
+        )
+    else:
+        # Compare whole BGRA pixels as uint32 instead of channel by channel
+        pixels = np.ascontiguousarray(frame).view(np.uint32)[..., 0]
+        prev_pixels = np.ascontiguousarray(prev).view(np.uint32)[..., 0]
+        diff = pixels != prev_pixels
+        changed = np.logical_or.reduceat(diff, np.arange(0, height, tile), axis=0)
+        changed = np.logical_or.reduceat(changed, np.arange(0, width, tile), axis=1)
+
+    rects = []
+    for row, cols in enumerate(changed):
+        if not cols.any():
+            continue
+        y = row * tile
+        h = min(tile, height - y)
+        # Find runs of consecutive dirty tiles in this row
+        edges = np.flatnonzero(np.diff(np.concatenate(([0], cols.view(np.int8), [0]))))
+        for start, stop in zip(edges[::2], edges[1::2]):
+            x = int(start) * tile
+            rects.append((x, y, min(int(stop) * tile, width) - x, h))
+    return rects
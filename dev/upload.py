@@ -0,0 +1,210 @@
+import asyncio
+import hashlib
+import json
+import os
+import struct
+import threading
+
+from fsjobs import Job, in_fs_thread
+from metrics import transfer_bytes
+from mux import BULK, Connector
+from reconnect import connect_with_backoff
+from rich import print
+
+MAX_CHANNELS = 8
+CONNECT_ATTEMPTS = 5
+HASH_CHUNK = 1024 * 1024
+
+# Every binary message on an upload channel is one chunk: the u64 file offset
+# it belongs at followed by its bytes. An empty message ends the channel.
+CHUNK = struct.Struct("<Q")
+
+
+class Ranges:
+    """Sorted, merged list of received [start, end) byte ranges."""
+
+    def __init__(self):
+        self.ranges: list[list[int]] = []
+        self.lock = threading.Lock()
+
+    def add(self, start: int, end: int):
+        with self.lock:
+            merged = []
+            for low, high in self.ranges:
+                if high < start or low > end:
+                    merged.append([low, high])
+                else:
+                    start, end = min(start, low), max(end, high)
+            merged.append([start, end])
+            self.ranges = sorted(merged)
+
+    def missing(self, size: int) -> list[tuple[int, int]]:
+        """Gaps as (offset, length) pairs."""
+        with self.lock:
+            gaps = []
+            position = 0
+            for low, high in self.ranges:
+                if low > position:
+                    gaps.append((position, low - position))
+                position = max(position, high)
+            if position < size:
+                gaps.append((position, size - position))
+            return gaps
+
+
+class Upload:
+    """One file being uploaded into ``<path>.part``, which replaces ``path`` once
+    every byte is there (and the checksum, if given, matches)."""
+
+    def __init__(self, path: str, size: int):
+        self.path = path
+        self.part = f"{path}.part"
+        self.size = size
+        self.received = Ranges()
+        self.fresh = True  # nothing received yet, any leftover .part is stale
+
+    def prepare(self):
+        # Reserve the whole file up front so parallel chunks never extend it
+        # piecemeal and a full disk fails now, not at 90 %
+        with open(self.part, "ab") as file:
+            if self.fresh:
+                # A leftover .part of a larger file would otherwise keep its tail
+                file.truncate(self.size)
+                self.fresh = False
+            if hasattr(os, "posix_fallocate") and self.size:
+                os.posix_fallocate(file.fileno(), 0, self.size)
+            elif os.path.getsize(self.part) < self.size:
+                file.truncate(self.size)
+
+    def write(self, file, offset: int, data: memoryview):
+        if offset + len(data) > self.size:
+            raise ValueError(f"Частина {offset}+{len(data)} виходить за межі файла")
+        file.seek(offset)
+        file.write(data)
+        self.received.add(offset, offset + len(data))
+
+    def sha256(self) -> str:
+        digest = hashlib.sha256()
+        with open(self.part, "rb") as file:
+            while chunk := file.read(HASH_CHUNK):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def finish(self):
+        os.replace(self.part, self.path)
+
+
+class Uploads:
+    """Unfinished uploads by target path, so a repeated 'upload' resumes one."""
+
+    def __init__(self):
+        self.pending: dict[str, Upload] = {}
+
+    def begin(self, path: str, size: int) -> Upload:
+        upload = self.pending.get(path)
+        if upload is None or upload.size != size or not os.path.exists(upload.part):
+            upload = Upload(path, size)
+            self.pending[path] = upload
+        return upload
+
+    def done(self, upload: Upload):
+        self.pending.pop(upload.path, None)
+
+
+async def receive_chunks(
+    connector: Connector, channel: str, upload: Upload, job: Job | None
+):
+    """Write the chunks arriving on one channel at their offsets until it ends."""
+    ws = await connect_with_backoff(
+        lambda: connector.connect(channel, BULK, header=True),
+        f"завантаження {channel}",
+        attempts=CONNECT_ATTEMPTS,
+    )
+    file = await in_fs_thread(open, upload.part, "r+b")
+    try:
+        async for message in ws:
+            if isinstance(message, str):
+                continue
+            if not message:
+                break
+            (offset,) = CHUNK.unpack_from(message)
+            data = memoryview(message)[CHUNK.size :]
+            await in_fs_thread(upload.write, file, offset, data)
+            transfer_bytes.inc(len(data), "upload")
+            if job:
+                job.advance(nbytes=len(data))
+    finally:
+        await in_fs_thread(file.close)
+        await ws.close()
+
+
+async def handle_upload_request(
+    ws, message, base: str, connector: Connector, uploads: Uploads, job: Job | None = None
+) -> bool:
+    """Handle 'upload' request: receive ``path`` (``size`` bytes) over stream channels.
+
+    The agent first answers with an ``uploadReady`` event listing the ``missing``
+    ranges, which is everything for a new upload and only the gaps when a
+    broken upload of the same path and size is repeated. The viewer then sends
+    those ranges as chunks over ``channels`` parallel channels (named like
+    ranged downloads). When all channels end, the file is checked against the
+    optional ``sha256`` and moved into place. Returns whether it was.
+    """
+    request_id = message["requestId"]
+    path = str(message["path"]).replace("root", base)
+    size = max(int(message["size"]), 0)
+    channels = min(max(int(message.get("channels", 1)), 1), MAX_CHANNELS)
+
+    def reply(event: str, **extra) -> str:
+        return json.dumps({"requestId": request_id, "event": event, **extra})
+
+    upload = uploads.begin(path, size)
+    try:
+        await in_fs_thread(upload.prepare)
+    except OSError as err:
+        print(f"Не вдалося підготувати {path}: {err}")
+        uploads.done(upload)
+        await ws.send(reply("upload", success=False, error=str(err)))
+        return False
+
+    missing = upload.received.missing(size)
+    if job:
+        job.total_files = 1
+        job.total_bytes = sum(length for _, length in missing)
+    await ws.send(reply("uploadReady", missing=missing, channels=channels))
+
+    if missing:
+        results = await asyncio.gather(
+            *(
+                receive_chunks(
+                    connector,
+                    request_id if channels == 1 else f"{request_id}:{index}",
+                    upload,
+                    job,
+                )
+                for index in range(channels)
+            ),
+            return_exceptions=True,
+        )
+        for result in results:
+            if isinstance(result, Exception):
+                print(f"Помилка при отриманні файла: {result!r}")
+
+    missing = upload.received.missing(size)
+    if missing:
+        # Kept for a resumed 'upload' of the same path and size
+        await ws.send(reply("upload", success=False, missing=missing))
+        return False
+
+    checksum = await in_fs_thread(upload.sha256) if message.get("sha256") else None
+    if checksum and checksum != str(message["sha256"]).lower():
+        uploads.done(upload)
+        await in_fs_thread(os.remove, upload.part)
+        await ws.send(reply("upload", success=False, sha256=checksum))
+        return False
+
+    await in_fs_thread(upload.finish)
+    uploads.done(upload)
+    print(f"Файл {path} отримано.")
+    await ws.send(reply("upload", success=True, **({"sha256": checksum} if checksum else {})))
+    return True
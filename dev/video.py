@@ -0,0 +1,180 @@
+import struct
+import time
+from dataclasses import dataclass, field
+from fractions import Fraction
+
+import av
+import numpy as np
+from av.video.frame import PictureType
+
+# Message layout (little-endian), same framing style as ``tiles.py``:
+#   header: kind (u8, always 2), flags (u8), codec (u8), frame width (u16),
+#           frame height (u16), packet count (u16)
+#   per packet: length (u32) followed by the encoded packet
+HEADER = struct.Struct("<BBBHHH")
+PACKET = struct.Struct("<I")
+
+KIND_VIDEO = 2
+FLAG_KEYFRAME = 0x01
+
+CODECS = {
+    # name: (codec id in the header, encoder, encoder options)
+    "h264": (
+        1,
+        "libx264",
+        {
+            "preset": "ultrafast",
+            "tune": "zerolatency",
+            "profile": "baseline",
+            # Rate control by timestamps, so a lower capture rate gets bigger frames
+            "x264-params": "force-cfr=0",
+        },
+    ),
+    "vp8": (
+        2,
+        "libvpx",
+        {"deadline": "realtime", "cpu-used": "8", "lag-in-frames": "0"},
+    ),
+}
+
+# Encoders that take a new bit_rate while open (x264 does once VBV is on); the
+# others are reopened for it at their next keyframe
+LIVE_BITRATE = {"h264"}
+
+# Frames are stamped with their capture time in milliseconds
+TIME_BASE = Fraction(1, 1000)
+
+
+def encoder_available(codec: str) -> bool:
+    """Check whether the bundled FFmpeg build ships an encoder for ``codec``."""
+    try:
+        av.codec.Codec(CODECS[codec][1], "w")
+        return True
+    except Exception:
+        return False
+
+
+@dataclass
+class VideoUpdate:
+    codec: str
+    width: int
+    height: int
+    keyframe: bool
+    packets: list[bytes] = field(default_factory=list)
+
+    def merge(self, newer: "VideoUpdate") -> "VideoUpdate":
+        """Coalesce unsent packets with newer ones, the decoder needs every inter frame."""
+        if newer.keyframe or (newer.width, newer.height) != (self.width, self.height):
+            return newer
+        return VideoUpdate(
+            self.codec,
+            self.width,
+            self.height,
+            self.keyframe,
+            self.packets + newer.packets,
+        )
+
+    def __len__(self) -> int:
+        return len(self.packets)
+
+    def size(self) -> int:
+        """Bytes ``pack`` produces."""
+        return HEADER.size + sum(PACKET.size + len(packet) for packet in self.packets)
+
+    def pack(self) -> bytes:
+        header = HEADER.pack(
+            KIND_VIDEO,
+            FLAG_KEYFRAME if self.keyframe else 0,
+            CODECS[self.codec][0],
+            self.width,
+            self.height,
+            len(self.packets),
+        )
+        return b"".join(
+            [header, *(PACKET.pack(len(packet)) + packet for packet in self.packets)]
+        )
+
+
+class VideoEncoder:
+    """Feed BGRA screen frames into an inter-frame codec (H.264 or VP8) through PyAV."""
+
+    def __init__(self, codec: str, fps: float, bitrate: int):
+        self.codec = codec
+        self.fps = fps
+        self.bitrate = bitrate
+        self.max_bitrate = bitrate
+        self.context = None
+        self.pts = 0
+        self.frames = 0
+        self.opened_at = 0.0
+
+    def set_bitrate(self, bitrate: int):
+        """Retarget the encoder, see ``QualityController``. Frame rate changes
+        need nothing: frames carry their capture time and rate control follows."""
+        self.bitrate = bitrate
+        if self.context is not None and self.codec in LIVE_BITRATE:
+            self.context.bit_rate = bitrate
+
+    def open(self, width: int, height: int, captured_at: float):
+        _, encoder, options = CODECS[self.codec]
+        options = dict(options)
+        if self.codec in LIVE_BITRATE:
+            options.update(
+                maxrate=str(self.max_bitrate), bufsize=str(self.max_bitrate // 2)
+            )
+        context = av.CodecContext.create(encoder, "w")
+        context.width = width
+        context.height = height
+        context.pix_fmt = "yuv420p"
+        context.bit_rate = self.bitrate
+        context.time_base = TIME_BASE
+        context.framerate = round(self.fps)
+        context.gop_size = round(self.fps) * 2
+        context.options = options
+        context.open()
+        self.context = context
+        self.pts = 0
+        self.frames = 0
+        self.opened_at = captured_at
+
+    def encode(
+        self, frame: np.ndarray, keyframe: bool = False, captured_at: float | None = None
+    ) -> VideoUpdate | None:
+        if captured_at is None:
+            captured_at = time.perf_counter()
+        # yuv420p needs even dimensions, drop the odd row/column if any
+        height, width = frame.shape[0] & ~1, frame.shape[1] & ~1
+        frame = np.ascontiguousarray(frame[:height, :width])
+
+        context = self.context
+        if (
+            context is None
+            or (context.width, context.height) != (width, height)
+            # A new bitrate for an encoder that only reads it when opened: reopen
+            # where a keyframe is due anyway
+            or context.bit_rate != self.bitrate
+            and (keyframe or self.frames % context.gop_size == 0)
+        ):
+            self.open(width, height, captured_at)
+            keyframe = True
+
+        video_frame = av.VideoFrame.from_ndarray(frame, format="bgra").reformat(
+            format="yuv420p"
+        )
+        timestamp = round((captured_at - self.opened_at) / TIME_BASE)
+        self.pts = video_frame.pts = max(timestamp, self.pts + 1 if self.frames else 0)
+        video_frame.time_base = TIME_BASE
+        self.frames += 1
+        if keyframe:
+            video_frame.pict_type = PictureType.I
+
+        packets = self.context.encode(video_frame)
+        if not packets:
+            return None
+        return VideoUpdate(
+            self.codec,
+            width,
+            height,
+            any(packet.is_keyframe for packet in packets),
+            [bytes(packet) for packet in packets],
+        )
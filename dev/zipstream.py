@@ -0,0 +1,247 @@
+import itertools
+import os
+import struct
+import time
+import zlib
+from collections import deque
+from concurrent.futures import Executor, Future
+from typing import Iterator
+
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
+
+CHUNK_SIZE = 1024 * 1024  # 1 MB chunks
+SAMPLE_SIZE = 64 * 1024
+
+# Final empty fixed-Huffman block that terminates a sequence of deflate_block()s
+DEFLATE_END = b"\x03\x00"
+
+# Formats that are already compressed, deflate can't shrink them
+INCOMPRESSIBLE = {
+    ".jpg", ".jpeg", ".png", ".gif", ".webp", ".heic", ".avif",
+    ".mp4", ".mkv", ".mov", ".avi", ".webm", ".m4v",
+    ".mp3", ".aac", ".ogg", ".opus", ".flac", ".m4a",
+    ".zip", ".gz", ".tgz", ".bz2", ".xz", ".7z", ".rar", ".zst", ".lz4",
+    ".docx", ".xlsx", ".pptx", ".odt", ".jar", ".apk", ".whl", ".dmg",
+}  # fmt: skip
+
+# Every entry is written as a Zip64 entry with a trailing data descriptor, so the
+# archive can be produced front to back without seeking and its layout (and
+# therefore its size in STORED mode) depends only on names and file sizes.
+LOCAL_HEADER = struct.Struct("<IHHHHHIIIHH")
+LOCAL_ZIP64_EXTRA = struct.Struct("<HHQQ")
+DATA_DESCRIPTOR = struct.Struct("<IIQQ")
+CENTRAL_HEADER = struct.Struct("<IHHHHHHIIIHHHHHII")
+CENTRAL_ZIP64_EXTRA = struct.Struct("<HHQQQ")
+ZIP64_END = struct.Struct("<IQHHIIQQQQ")
+ZIP64_LOCATOR = struct.Struct("<IIQI")
+END = struct.Struct("<IHHHHIIH")
+
+VERSION = 45  # Zip64
+FLAGS = 0x0808  # data descriptor follows the data, names are UTF-8
+UNKNOWN = 0xFFFFFFFF
+
+
+def dos_time(mtime: float) -> tuple[int, int]:
+    t = time.localtime(max(mtime, 315532800))  # DOS dates start in 1980
+    return (
+        t.tm_hour << 11 | t.tm_min << 5 | t.tm_sec // 2,
+        (t.tm_year - 1980) << 9 | t.tm_mon << 5 | t.tm_mday,
+    )
+
+
+def walk_files(folder_path: str) -> Iterator[tuple[str, str, os.stat_result]]:
+    """Yield (path, name inside the archive, stat) for every file under ``folder_path``."""
+    for root, dirs, files in os.walk(folder_path):
+        for file in files:
+            file_path = os.path.join(root, file)
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                continue
+            archive_name = os.path.relpath(file_path, folder_path).replace(os.sep, "/")
+            yield file_path, archive_name, stat
+
+
+def stored_size(entries: list[tuple[str, str, os.stat_result]]) -> int:
+    """Exact size of the archive ``stream_zip`` produces for ``entries`` in ``stored`` mode."""
+    total = ZIP64_END.size + ZIP64_LOCATOR.size + END.size
+    for _, archive_name, stat in entries:
+        name = len(archive_name.encode("utf-8"))
+        total += LOCAL_HEADER.size + name + LOCAL_ZIP64_EXTRA.size
+        total += stat.st_size + DATA_DESCRIPTOR.size
+        total += CENTRAL_HEADER.size + name + CENTRAL_ZIP64_EXTRA.size
+    return total
+
+
+def read_chunks(file_path: str, size: int, exact: bool) -> Iterator[bytes]:
+    """Read a file in chunks; with ``exact`` emit precisely ``size`` bytes, padding with zeros.
+
+    STORED archives announce their size upfront, so a file that shrank or became
+    unreadable after the walk must not change the archive length.
+    """
+    remaining = size
+    try:
+        with open(file_path, "rb") as file:
+            while chunk := file.read(min(CHUNK_SIZE, remaining) if exact else CHUNK_SIZE):
+                if exact:
+                    remaining -= len(chunk)
+                yield chunk
+    except OSError as err:
+        print(f"Не вдалося прочитати {file_path}: {err}")
+    while exact and remaining > 0:
+        chunk = bytes(min(CHUNK_SIZE, remaining))
+        remaining -= len(chunk)
+        yield chunk
+
+
+def deflate_block(data: bytes, level: int) -> bytes:
+    # Each block is an independent raw deflate stream ending in a sync flush, so
+    # blocks compressed on different threads can simply be concatenated
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    return compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+
+def choose_method(archive_name: str, sample: bytes, compression: str) -> int:
+    """Pick STORED or DEFLATED for one entry.
+
+    ``auto`` stores known compressed formats and files whose first block barely
+    shrinks under a fast deflate probe; deflate would only burn CPU on them.
+    """
+    if compression == "stored":
+        return ZIP_STORED
+    if compression == "deflate":
+        return ZIP_DEFLATED
+    if os.path.splitext(archive_name)[1].lower() in INCOMPRESSIBLE:
+        return ZIP_STORED
+    sample = sample[:SAMPLE_SIZE]
+    if len(sample) >= 4096 and len(zlib.compress(sample, 1)) > len(sample) * 0.95:
+        return ZIP_STORED
+    return ZIP_DEFLATED
+
+
+def compressed_blocks(
+    entries, compression: str, level: int, executor: Executor | None, ahead: int
+):
+    """Read entries block by block and deflate up to ``ahead`` blocks in parallel.
+
+    Yields ``("start", entry, method)``, ``("block", raw, data)`` and ``("end",)``
+    events strictly in archive order.
+    """
+    pending = deque()
+    in_flight = 0
+
+    def resolve(event):
+        if event[0] == "block" and isinstance(event[2], Future):
+            return "block", event[1], event[2].result()
+        return event
+
+    for entry in entries:
+        file_path, archive_name, stat = entry
+        blocks = read_chunks(file_path, stat.st_size, compression == "stored")
+        first = next(blocks, b"")
+        method = choose_method(archive_name, first, compression)
+        pending.append(("start", entry, method))
+
+        for raw in itertools.chain([first] if first else [], blocks):
+            if method == ZIP_STORED:
+                pending.append(("block", raw, raw))
+            elif executor:
+                pending.append(("block", raw, executor.submit(deflate_block, raw, level)))
+            else:
+                pending.append(("block", raw, deflate_block(raw, level)))
+            in_flight += 1
+
+            # Keep memory bounded: hand out finished blocks once enough are queued
+            while in_flight > ahead:
+                event = resolve(pending.popleft())
+                in_flight -= event[0] == "block"
+                yield event
+        pending.append(("end",))
+
+    while pending:
+        yield resolve(pending.popleft())
+
+
+def zip_pieces(
+    entries,
+    compression: str = "auto",
+    level: int = 6,
+    executor: Executor | None = None,
+    ahead: int = 16,
+) -> Iterator[bytes]:
+    """Yield the archive for ``entries`` front to back, one header or data block at a time.
+
+    ``compression`` is ``auto`` (content-aware), ``deflate`` or ``stored``.
+    """
+    offset = 0
+    central = []
+
+    for event in compressed_blocks(entries, compression, level, executor, ahead):
+        if event[0] == "start":
+            (_, archive_name, stat), method = event[1], event[2]
+            name = archive_name.encode("utf-8")
+            mod_time, mod_date = dos_time(stat.st_mtime)
+            header = LOCAL_HEADER.pack(
+                0x04034B50, VERSION, FLAGS, method, mod_time, mod_date,
+                0, UNKNOWN, UNKNOWN, len(name), LOCAL_ZIP64_EXTRA.size,
+            )  # fmt: skip
+            header += name + LOCAL_ZIP64_EXTRA.pack(1, 16, 0, 0)
+            yield header
+
+            crc = 0
+            size = 0
+            compressed_size = 0
+
+        elif event[0] == "block":
+            raw, data = event[1], event[2]
+            crc = zlib.crc32(raw, crc)
+            size += len(raw)
+            compressed_size += len(data)
+            yield data
+
+        else:
+            if method == ZIP_DEFLATED:
+                compressed_size += len(DEFLATE_END)
+                yield DEFLATE_END
+
+            yield DATA_DESCRIPTOR.pack(0x08074B50, crc, compressed_size, size)
+
+            central.append(
+                CENTRAL_HEADER.pack(
+                    0x02014B50, VERSION | 3 << 8, VERSION, FLAGS, method,
+                    mod_time, mod_date, crc, UNKNOWN, UNKNOWN, len(name),
+                    CENTRAL_ZIP64_EXTRA.size, 0, 0, 0, (stat.st_mode & 0xFFFF) << 16,
+                    UNKNOWN,
+                )  # fmt: skip
+                + name
+                + CENTRAL_ZIP64_EXTRA.pack(1, 24, size, compressed_size, offset)
+            )
+            offset += len(header) + compressed_size + DATA_DESCRIPTOR.size
+
+    central_offset = offset
+    central_size = sum(len(record) for record in central)
+    yield from central
+    yield ZIP64_END.pack(
+        0x06064B50, ZIP64_END.size - 12, VERSION, VERSION, 0, 0,
+        len(central), len(central), central_size, central_offset,
+    )  # fmt: skip
+    yield ZIP64_LOCATOR.pack(0x07064B50, 0, central_offset + central_size, 1)
+    yield END.pack(0x06054B50, 0, 0, 0xFFFF, 0xFFFF, UNKNOWN, UNKNOWN, 0)
+
+
+def stream_zip(
+    entries,
+    compression: str = "auto",
+    level: int = 6,
+    executor: Executor | None = None,
+) -> Iterator[bytes]:
+    """Like ``zip_pieces`` but regrouped into chunks of exactly ``CHUNK_SIZE`` bytes."""
+    buffer = bytearray()
+    for piece in zip_pieces(entries, compression, level, executor):
+        buffer += piece
+        while len(buffer) >= CHUNK_SIZE:
+            yield bytes(buffer[:CHUNK_SIZE])
+            del buffer[:CHUNK_SIZE]
+    if buffer:
+        yield bytes(buffer)